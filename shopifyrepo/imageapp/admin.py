@@ -1,19 +1,100 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 from .models import (
     Photo,
     Coupon,
-    Payment, 
-    OrderPhoto, 
-    Order, 
+    Payment,
+    OrderPhoto,
+    Order,
     UserProfile,
-    Address
+    Address,
+    PaymentAttempt,
 )
 
 
-admin.site.register(Photo)
-admin.site.register(Coupon)
-admin.site.register(UserProfile)
-admin.site.register(Payment)
-admin.site.register(Order)
-admin.site.register(OrderPhoto)
-admin.site.register(Address)
\ No newline at end of file
+class CappedCountPaginator(Paginator):
+    """
+    Counts at most ``max_count`` rows, so COUNT(*) over a huge table stays
+    cheap. Past the cap the changelist only links the first pages; use the
+    filters or search to get to older rows.
+    """
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.max_count].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    # the primary key index keeps ordering and LIMIT/OFFSET cheap
+    ordering = ('-pk',)
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'ordered_date', 'ordered', 'being_delivered', 'received',
+                    'payment', 'coupon')
+    list_select_related = ('user', 'payment__user', 'coupon')
+    list_filter = ('ordered', 'being_delivered', 'received')
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user', 'photos', 'payment', 'coupon', 'shipping_address', 'billing_address')
+
+
+@admin.register(OrderPhoto)
+class OrderPhotoAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'photo', 'quantity', 'unit_price', 'ordered')
+    list_select_related = ('user', 'photo')
+    list_filter = ('ordered',)
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user', 'photo')
+
+
+@admin.register(Payment)
+class PaymentAdmin(LargeTableAdmin):
+    list_display = ('id', 'stripe_charge_id', 'user', 'amount', 'timestamp')
+    list_select_related = ('user',)
+    search_fields = ('=stripe_charge_id', '=user__username')
+    raw_id_fields = ('user',)
+
+
+@admin.register(PaymentAttempt)
+class PaymentAttemptAdmin(LargeTableAdmin):
+    list_display = ('key', 'user', 'order', 'status', 'charge_id', 'created')
+    list_select_related = ('user', 'order__user')
+    list_filter = ('status',)
+    search_fields = ('=key', '=charge_id')
+    raw_id_fields = ('user', 'order')
+
+
+@admin.register(Photo)
+class PhotoAdmin(admin.ModelAdmin):
+    list_display = ('description', 'user', 'price', 'discount_price')
+    list_select_related = ('user',)
+    search_fields = ('=slug', '=user__username')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Coupon)
+class CouponAdmin(admin.ModelAdmin):
+    list_display = ('code', 'amount', 'times_used', 'max_uses', 'valid_until')
+    search_fields = ('=code',)
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'stripe_customer_id', 'one_click_purchasing')
+    list_select_related = ('user',)
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(Address)
+class AddressAdmin(admin.ModelAdmin):
+    list_display = ('user', 'street_address', 'country', 'zip', 'address_type', 'default')
+    list_select_related = ('user',)
+    list_filter = ('address_type', 'default')
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user',)
@@ -0,0 +1,34 @@
+"""
+Helpers for the async views.
+
+ORM access goes through ``sync_to_async`` (which runs it on the one thread
+Django's database connections are bound to). Blocking work that does not
+touch the database, like payment provider calls and image rendering, runs
+on a separate pool of ``ASGI_THREADS`` threads so it never queues behind
+the ORM and never blocks the event loop.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASGI_THREADS, thread_name_prefix='imageapp-io')
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
@@ -0,0 +1,171 @@
+"""
+Read-only JSON API over the photo catalogue.
+
+Every endpoint accepts ``?fields=a,b,c`` to return only some fields (and
+only load the columns they need). Lists are paginated by primary key with
+an opaque ``cursor`` instead of page numbers, so no COUNT query is made and
+deep pages cost the same as the first one.
+"""
+import base64
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+
+from .models import Photo
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+THUMBNAIL_SIZE = (430, 360)
+
+
+def _final_price(photo):
+    return photo.discount_price or photo.price
+
+
+FIELDS = {
+    # name: (columns to load, value)
+    'id': ((), lambda photo: photo.pk),
+    'slug': (('slug',), lambda photo: photo.slug),
+    'description': (('description',), lambda photo: photo.description),
+    'user': (('user__username',), lambda photo: photo.user.username),
+    'price': (('price',), lambda photo: photo.price),
+    'discount_price': (('discount_price',), lambda photo: photo.discount_price),
+    'final_price': (('price', 'discount_price'), _final_price),
+    'url': (('slug',), lambda photo: photo.get_absolute_url()),
+    'image': (('image',), lambda photo: photo.image.url),
+    'thumbnail': ((), lambda photo: photo.get_rendition_url(*THUMBNAIL_SIZE)),
+    'thumbnail_webp': ((), lambda photo: photo.get_rendition_url(*THUMBNAIL_SIZE, fmt='webp')),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), cls=DjangoJSONEncoder).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def api_view(view):
+    view = require_GET(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return json_response({'error': str(e)}, status=400)
+        except Http404:
+            return json_response({'error': "Not found"}, status=404)
+    return wrapper
+
+
+def get_fields(request):
+    names = request.GET.get('fields')
+    if not names:
+        return list(FIELDS)
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise BadRequest("Unknown fields: " + ", ".join(unknown))
+    return names
+
+
+def photo_queryset(fields):
+    columns = {column for name in fields for column in FIELDS[name][0]}
+    photos = Photo.objects.only('pk', *columns)
+    if 'user__username' in columns:
+        photos = photos.select_related('user')
+    return photos
+
+
+def serialize(photo, fields):
+    return {name: FIELDS[name][1](photo) for name in fields}
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+
+
+def get_int(request, name, default, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+    return max(1, min(value, maximum))
+
+
+def paginate(request, photos, fields):
+    limit = get_int(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+    photos = photos.order_by('pk')
+    if request.GET.get('cursor'):
+        photos = photos.filter(pk__gt=decode_cursor(request.GET['cursor']))
+    # one extra row tells whether there is a next page
+    page = list(photos[:limit + 1])
+    next_url = None
+    if len(page) > limit:
+        page = page[:limit]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor(page[-1].pk)
+        next_url = request.path + '?' + params.urlencode()
+    return json_response({
+        'results': [serialize(photo, fields) for photo in page],
+        'next': next_url,
+    })
+
+
+@api_view
+def photo_list(request):
+    fields = get_fields(request)
+    return paginate(request, photo_queryset(fields), fields)
+
+
+@api_view
+def user_photo_list(request, username):
+    fields = get_fields(request)
+    return paginate(request, photo_queryset(fields).filter(user__username=username), fields)
+
+
+@api_view
+def photo_detail(request, slug):
+    fields = get_fields(request)
+    photo = get_object_or_404(photo_queryset(fields), slug=slug)
+    return json_response(serialize(photo, fields))
+
+
+@api_view
+def photo_batch(request):
+    fields = get_fields(request)
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        raise BadRequest("ids must be a comma separated list of integers")
+    if len(ids) > MAX_LIMIT:
+        raise BadRequest(f"At most {MAX_LIMIT} ids per request")
+    photos = photo_queryset(fields).in_bulk(ids)
+    return json_response({
+        'results': [serialize(photos[pk], fields) for pk in ids if pk in photos],
+    })
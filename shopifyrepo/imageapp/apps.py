@@ -3,3 +3,23 @@ from django.apps import AppConfig
 
 class ImageappConfig(AppConfig):
     name = 'imageapp'
+
+    def ready(self):
+        from allauth.account.signals import user_logged_in
+        from django.apps import apps
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+        from .cache import invalidate_receiver as cache_invalidate_receiver
+        from .cart import merge_cart_receiver
+        from .coupons import invalidate_receiver
+        from .models import Coupon
+        from .templating import metrics_receiver, render_timed
+        user_logged_in.connect(merge_cart_receiver)
+        post_save.connect(invalidate_receiver, sender=Coupon)
+        post_delete.connect(invalidate_receiver, sender=Coupon)
+        if settings.TEMPLATE_TIMING:
+            render_timed.connect(metrics_receiver)
+        for label in settings.CACHE_INVALIDATION:
+            model = apps.get_model(label)
+            post_save.connect(cache_invalidate_receiver, sender=model)
+            post_delete.connect(cache_invalidate_receiver, sender=model)
@@ -0,0 +1,67 @@
+"""
+Async versions of the I/O bound views, used when settings.ASYNC_VIEWS is on
+(the default under shopifyrepo/asgi.py).
+
+They only await: database work runs through sync_to_async and provider
+calls and image rendering through aio.run_blocking, so a slow upstream
+holds a pool thread instead of a whole worker. Everything else is still
+served by the sync views in views.py.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.shortcuts import redirect
+
+from . import aio, payments, renditions
+from .models import Photo
+from .views import PaymentView
+
+
+async def photo_rendition(request, pk, width, height, fmt, signature):
+    if not renditions.is_valid_request(pk, width, height, fmt, signature):
+        return HttpResponseForbidden("Invalid rendition signature")
+    photo = await sync_to_async(Photo.objects.filter(pk=pk).first)()
+    if photo is None:
+        raise Http404("No photo matches the given query.")
+    path = await aio.run_blocking(renditions.get_rendition, photo, width, height, fmt)
+    if path is None:
+        # another worker is still rendering it, serve the original meanwhile
+        response = redirect(photo.image.url)
+        response['Cache-Control'] = 'no-store'
+        return response
+    # renditions are bounded by RENDITION_MAX_SIZE, read them off the loop in one go
+    response = HttpResponse(await aio.run_blocking(_read, path),
+                            content_type=renditions.content_type(fmt))
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+_sync_payment = sync_to_async(PaymentView.as_view())
+
+
+async def payment(request, payment_option):
+    if request.method != 'POST':
+        return await _sync_payment(request, payment_option=payment_option)
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return redirect_to_login(request.get_full_path())
+
+    view = PaymentView()
+    view.setup(request, payment_option=payment_option)
+    stripe = payments.get_stripe()
+    pending = await sync_to_async(view.begin)()
+    if not isinstance(pending, payments.PendingPayment):
+        return pending
+    try:
+        customer_id = await aio.run_blocking(view.create_customer, stripe, pending)
+        if customer_id:
+            await sync_to_async(view.save_customer)(pending, customer_id)
+        pending.charge = await aio.run_blocking(view.create_charge, stripe, pending)
+        return await sync_to_async(view.complete)(pending)
+    except Exception as e:
+        return await sync_to_async(view.failed)(
+            pending.attempt, payments.error_message(e), pending.charge)
@@ -0,0 +1,194 @@
+"""
+Two-tier cache backend.
+
+L2 is Django's file-based cache in a directory shared by all workers of a
+host. L1 is a per-process LRU in front of it, bounded by the pickled size
+of its entries, that keeps entries for at most L1_TTL seconds, so another
+worker's set() or delete() is seen within that time.
+
+Keys are grouped by prefix: ``photo:42`` is in ``photo``, Django's
+``template.cache.x.<hash>`` fragment keys in ``template.cache.x`` and keys
+with neither separator in ``default``. The prefixes listed in the
+CACHE_INVALIDATION setting, which are bumped when their models change, can
+be invalidated as a whole instantly everywhere: each of them has a version
+that is part of the stored keys. ``bump()`` changes the version in L2,
+which the workers re-read at most every VERSION_TTL seconds, so everything
+cached under the old version is simply never read again. Other keys are
+stored as they are.
+
+L1 hits, L2 hits, misses and L1 evictions are counted per prefix in the
+metrics.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+from . import metrics
+
+
+_MISSING = object()
+VERSION_KEY = '_version:'
+
+
+def key_prefix(key):
+    if ':' in key:
+        return key.split(':', 1)[0]
+    return key.rpartition('.')[0] or 'default'
+
+
+def versioned_prefixes():
+    return frozenset(prefix for prefixes in settings.CACHE_INVALIDATION.values() for prefix in prefixes)
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = dict(params.get('OPTIONS', {}))
+        self.l1_max_bytes = options.pop('L1_MAX_BYTES', 16 * 1024 * 1024)
+        self.l1_ttl = options.pop('L1_TTL', 5)
+        self.version_ttl = options.pop('VERSION_TTL', 1)
+        # prefixes that must always be read from L2, like sessions
+        self.l1_exclude = tuple(options.pop('L1_EXCLUDE', ()))
+        self.l2 = FileBasedCache(location, dict(params, OPTIONS=options))
+        self.versioned = versioned_prefixes()
+        self._l1 = OrderedDict()
+        self._l1_bytes = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    # prefix versions
+
+    def get_prefix_version(self, prefix):
+        now = time.monotonic()
+        cached = self._versions.get(prefix)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        current = self.l2.get(VERSION_KEY + prefix)
+        if current is None:
+            # start from the clock, so a lost version never revives old entries
+            self.l2.add(VERSION_KEY + prefix, int(time.time() * 1000), None)
+            current = self.l2.get(VERSION_KEY + prefix, 0)
+        self._versions[prefix] = (now + self.version_ttl, current)
+        return current
+
+    def bump(self, *prefixes):
+        """Invalidate every key under ``prefixes`` in all workers."""
+        for prefix in prefixes:
+            if prefix not in self.versioned:
+                raise ValueError(f"Cache prefix {prefix!r} is not listed in CACHE_INVALIDATION")
+            current = self.l2.get(VERSION_KEY + prefix, 0)
+            new = max(current + 1, int(time.time() * 1000))
+            self.l2.set(VERSION_KEY + prefix, new, None)
+            self._versions[prefix] = (time.monotonic() + self.version_ttl, new)
+            metrics.incr(f"cache.{prefix}.bumps")
+
+    def _keys(self, key, version):
+        """The prefix, the key L2 is given and the key L1 uses."""
+        prefix = key_prefix(key)
+        stored = f"{key}#{self.get_prefix_version(prefix)}" if prefix in self.versioned else key
+        return prefix, stored, self.make_key(stored, version=version)
+
+    # L1
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return _MISSING
+            expires, data, prefix = entry
+            if expires <= time.monotonic():
+                del self._l1[key]
+                self._l1_bytes -= len(data)
+                return _MISSING
+            self._l1.move_to_end(key)
+            return data
+
+    def _l1_set(self, key, prefix, value, timeout):
+        if prefix.startswith(self.l1_exclude):
+            return
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        ttl = self.l1_ttl if timeout is None else min(timeout, self.l1_ttl)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        evicted = []
+        with self._lock:
+            self._l1_pop(key)
+            if ttl <= 0 or len(data) > self.l1_max_bytes:
+                return
+            self._l1[key] = (time.monotonic() + ttl, data, prefix)
+            self._l1_bytes += len(data)
+            while self._l1_bytes > self.l1_max_bytes:
+                old_key, (expires, old_data, old_prefix) = self._l1.popitem(last=False)
+                self._l1_bytes -= len(old_data)
+                evicted.append(old_prefix)
+        for old_prefix in evicted:
+            metrics.incr(f"cache.{old_prefix}.evictions")
+
+    def _l1_pop(self, key):
+        entry = self._l1.pop(key, None)
+        if entry is not None:
+            self._l1_bytes -= len(entry[1])
+
+    # cache API
+
+    def get(self, key, default=None, version=None):
+        prefix, stored, l1_key = self._keys(key, version)
+        data = self._l1_get(l1_key)
+        if data is not _MISSING:
+            metrics.incr(f"cache.{prefix}.l1_hits")
+            return pickle.loads(data)
+        value = self.l2.get(stored, _MISSING, version=version)
+        if value is _MISSING:
+            metrics.incr(f"cache.{prefix}.misses")
+            return default
+        metrics.incr(f"cache.{prefix}.l2_hits")
+        self._l1_set(l1_key, prefix, value, self.l1_ttl)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        prefix, stored, l1_key = self._keys(key, version)
+        self.l2.set(stored, value, timeout, version=version)
+        self._l1_set(l1_key, prefix, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        prefix, stored, l1_key = self._keys(key, version)
+        if not self.l2.add(stored, value, timeout, version=version):
+            return False
+        self._l1_set(l1_key, prefix, value, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        prefix, stored, l1_key = self._keys(key, version)
+        with self._lock:
+            self._l1_pop(l1_key)
+        return self.l2.touch(stored, timeout, version=version)
+
+    def delete(self, key, version=None):
+        prefix, stored, l1_key = self._keys(key, version)
+        with self._lock:
+            self._l1_pop(l1_key)
+        return self.l2.delete(stored, version=version)
+
+    def has_key(self, key, version=None):
+        # not through get(), so the hit and miss counts are only real reads
+        prefix, stored, l1_key = self._keys(key, version)
+        if self._l1_get(l1_key) is not _MISSING:
+            return True
+        return self.l2.has_key(stored, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+        self._versions.clear()
+        self.l2.clear()
+
+
+def invalidate_receiver(sender, **kwargs):
+    if hasattr(cache, 'bump'):
+        cache.bump(*settings.CACHE_INVALIDATION[sender._meta.label])
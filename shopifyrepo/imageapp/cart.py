@@ -0,0 +1,175 @@
+"""
+Carts of anonymous visitors.
+
+The cart lives in a signed cookie as ``{photo pk: quantity}``, so browsing
+and building a cart costs no database writes. When the visitor logs in it
+is merged into their open Order in a constant number of queries.
+"""
+import logging
+
+from django.conf import settings
+from django.core import signing
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+
+from .models import Order, OrderPhoto, Photo
+from .sales import increment
+
+
+logger = logging.getLogger(__name__)
+
+COOKIE_SALT = 'imageapp.cart'
+
+
+class CookieCart:
+    # mirrors the parts of Order used by order_summary.html
+    coupon = None
+
+    def __init__(self, request):
+        self.request = request
+        self.changed = False
+        try:
+            items = signing.loads(
+                request.COOKIES[settings.CART_COOKIE_NAME],
+                salt=COOKIE_SALT,
+                max_age=settings.CART_COOKIE_AGE,
+            )
+        except (KeyError, signing.BadSignature):
+            items = {}
+        if not isinstance(items, dict):
+            items = {}
+        self.items = items
+        self._photos = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, photo):
+        return str(photo.pk) in self.items
+
+    @property
+    def photos(self):
+        return self
+
+    def count(self):
+        return len(self)
+
+    def all(self):
+        if self._photos is None:
+            photos = Photo.objects.in_bulk([int(pk) for pk in self.items])
+            self._photos = [
+                OrderPhoto(photo=photos[int(pk)], quantity=quantity)
+                for pk, quantity in self.items.items()
+                if int(pk) in photos
+            ]
+        return self._photos
+
+    def get_total(self):
+        return sum(order_photo.get_final_price() for order_photo in self.all())
+
+    def add(self, photo):
+        key = str(photo.pk)
+        if key not in self.items and len(self.items) >= settings.CART_MAX_ITEMS:
+            return False
+        self.items[key] = self.items.get(key, 0) + 1
+        self._changed()
+        return True
+
+    def remove(self, photo):
+        self.items.pop(str(photo.pk), None)
+        self._changed()
+
+    def remove_single(self, photo):
+        key = str(photo.pk)
+        if self.items.get(key, 0) > 1:
+            self.items[key] -= 1
+        else:
+            self.items.pop(key, None)
+        self._changed()
+
+    def clear(self):
+        self.items = {}
+        self._changed()
+
+    def _changed(self):
+        self.changed = True
+        self._photos = None
+
+    def update_response(self, response):
+        if not self.changed:
+            return
+        if self.items:
+            response.set_cookie(
+                settings.CART_COOKIE_NAME,
+                signing.dumps(self.items, salt=COOKIE_SALT, compress=True),
+                max_age=settings.CART_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE or None,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+
+
+def get_cart(request):
+    if not hasattr(request, '_cookie_cart'):
+        request._cookie_cart = CookieCart(request)
+    return request._cookie_cart
+
+
+class CookieCartMiddleware(MiddlewareMixin):
+    # MiddlewareMixin works under both WSGI and ASGI, so async views
+    # aren't pushed back onto a thread for this
+
+    def process_response(self, request, response):
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is not None:
+            cart.update_response(response)
+        return response
+
+
+def merge_cart(cart, user):
+    """Move the cookie cart into the user's open Order and empty it."""
+    if not cart.items:
+        return
+    quantities = {int(pk): quantity for pk, quantity in cart.items.items()}
+    photo_ids = set(Photo.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+
+    if not photo_ids:
+        cart.clear()
+        return
+
+    with transaction.atomic():
+        # an UPDATE first, so on SQLite the transaction holds the write lock
+        # before it reads anything and can't fail upgrading to it. Only the
+        # lines of the open order: removing the last unit of a photo from
+        # the cart leaves its line behind, outside any order.
+        increment(OrderPhoto, {'order__user': user, 'order__ordered': False}, 'photo_id', {
+            photo_id: {'quantity': quantities[photo_id]} for photo_id in photo_ids
+        })
+        order = Order.objects.filter(user=user, ordered=False).first()
+        if order is None:
+            order = Order.objects.create(user=user, ordered_date=timezone.now())
+
+        missing = photo_ids - set(order.photos.values_list('photo_id', flat=True))
+        if missing:
+            leftovers = OrderPhoto.objects.filter(
+                user=user, ordered=False, order=None, photo_id__in=missing)
+            leftovers.delete()
+            OrderPhoto.objects.bulk_create([
+                OrderPhoto(user=user, photo_id=photo_id, quantity=quantities[photo_id])
+                for photo_id in missing
+            ])
+            # not every backend returns primary keys from bulk_create
+            order.photos.add(*leftovers.values_list('pk', flat=True))
+
+    cart.clear()
+
+
+def merge_cart_receiver(sender, request, user, **kwargs):
+    try:
+        merge_cart(get_cart(request), user)
+    except DatabaseError:
+        # the login still succeeds and the cookie cart is merged next time
+        logger.exception("Could not merge the cart of user %s", user.pk)
@@ -0,0 +1,53 @@
+"""
+Coupon lookups and redemption.
+
+Coupons are looked up through a per-process LRU cache (misses are cached
+too, so bogus codes don't reach the database either). Saving or deleting a
+coupon clears the cache of the process that did it; other workers pick
+the change up within COUPON_CACHE_TTL seconds. Usage limits and validity
+windows are enforced when the order is paid, with one conditional UPDATE.
+"""
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .lru import LRUCache
+from .models import Coupon
+
+
+_MISSING = object()
+_cache = LRUCache(settings.COUPON_CACHE_SIZE, settings.COUPON_CACHE_TTL)
+
+
+def get_coupon(code):
+    coupon = _cache.get(code)
+    if coupon is None:
+        coupon = Coupon.objects.filter(code=code).first() or _MISSING
+        _cache.set(code, coupon)
+    return None if coupon is _MISSING else coupon
+
+
+def invalidate_receiver(sender, instance, *args, **kwargs):
+    # the code itself may have changed, so drop everything
+    _cache.clear()
+
+
+def redeem(coupon_id):
+    """Count one use of the coupon; False if it is expired or used up."""
+    now = timezone.now()
+    redeemed = Coupon.objects.filter(
+        Q(valid_from__isnull=True) | Q(valid_from__lte=now),
+        Q(valid_until__isnull=True) | Q(valid_until__gt=now),
+        Q(max_uses__isnull=True) | Q(times_used__lt=F('max_uses')),
+        pk=coupon_id,
+    ).update(times_used=F('times_used') + 1) == 1
+    if not redeemed:
+        # the cached copy still looks valid, don't keep offering it
+        _cache.clear()
+    return redeemed
+
+
+def release(coupon_id):
+    """Give back a use counted by redeem() for a payment that failed."""
+    Coupon.objects.filter(pk=coupon_id, times_used__gt=0).update(
+        times_used=F('times_used') - 1)
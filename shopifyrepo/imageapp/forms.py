@@ -1,4 +1,6 @@
 from django import forms
+from django.utils import translation
+from django.utils.functional import Promise
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
 
@@ -9,12 +11,46 @@ PAYMENT_CHOICES = (
 )
 
 
+class CachedCountrySelectWidget(CountrySelectWidget):
+    """
+    Sorting the ~250 translated country names and rendering their options
+    takes tens of ms per select, so both are done once per language. The
+    markup is only reused when nothing is selected (every unbound form).
+    The per-form copies of a widget share its caches.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._choices_by_language = {}
+        self._rendered = {}
+
+    def get_choices(self):
+        choices = self._choices
+        if isinstance(choices, Promise):
+            language = translation.get_language()
+            if language not in self._choices_by_language:
+                self._choices_by_language[language] = list(choices)
+            return self._choices_by_language[language]
+        return choices
+
+    choices = property(get_choices, CountrySelectWidget.set_choices)
+
+    def render(self, name, value, attrs=None, renderer=None):
+        if value:
+            return super().render(name, value, attrs, renderer)
+        key = (translation.get_language(), name, tuple(sorted((attrs or {}).items())))
+        html = self._rendered.get(key)
+        if html is None:
+            html = self._rendered[key] = super().render(name, value, attrs, renderer)
+        return html
+
+
 class CheckoutForm(forms.Form):
     shipping_address = forms.CharField(required=False)
     shipping_address2 = forms.CharField(required=False)
     shipping_country = CountryField(blank_label='(select country)').formfield(
         required=False,
-        widget=CountrySelectWidget(attrs={
+        widget=CachedCountrySelectWidget(attrs={
             'class': 'custom-select d-block w-100',
         }))
     shipping_zip = forms.CharField(required=False)
@@ -23,7 +59,7 @@ class CheckoutForm(forms.Form):
     billing_address2 = forms.CharField(required=False)
     billing_country = CountryField(blank_label='(select country)').formfield(
         required=False,
-        widget=CountrySelectWidget(attrs={
+        widget=CachedCountrySelectWidget(attrs={
             'class': 'custom-select d-block w-100',
         }))
     billing_zip = forms.CharField(required=False)
@@ -49,6 +85,7 @@ class CouponForm(forms.Form):
 
 
 class PaymentForm(forms.Form):
+    idempotency_key = forms.CharField(max_length=64)
     stripeToken = forms.CharField(required=False)
     save = forms.BooleanField(required=False)
     use_default = forms.BooleanField(required=False)
@@ -0,0 +1,359 @@
+"""
+A small HTTP load generator for the shop. ``manage.py compare_servers``
+sends the same scenario to several deployments; ``manage.py loadtest``
+drives whole browse, cart, checkout and pay journeys against one, with
+users and photos made by ``manage.py seed_loadtest``. Only the standard
+library is needed on the client side; data is prepared straight in the
+database the servers under test use.
+"""
+import http.client
+import io
+import itertools
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.middleware.csrf import _get_new_csrf_token
+from django.urls import reverse
+from django.utils import timezone
+
+from . import sales
+from .models import Order, OrderPhoto, Payment, PaymentAttempt, Photo
+from .renditions import rendition_url
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def fetch(base_url, method, path, body=None, headers=None, timeout=60):
+    """Send one request, returning the status and the response headers."""
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.headers
+    finally:
+        connection.close()
+
+
+def send(base_url, method, path, body=None, headers=None, timeout=60):
+    return fetch(base_url, method, path, body, headers, timeout)[0]
+
+
+def run(base_url, requests, concurrency):
+    """
+    Send ``requests`` (a list of ``(method, path, body, headers)``) with
+    ``concurrency`` clients and summarize the latencies.
+    """
+    def timed(request):
+        start = time.perf_counter()
+        try:
+            status = send(base_url, *request)
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, requests))
+    elapsed = time.perf_counter() - start
+    return summarize(results, elapsed)
+
+
+def summarize(results, elapsed):
+    statuses = Counter(str(status) for status, latency in results)
+    latencies = sorted(latency for status, latency in results)
+    errors = sum(count for status, count in statuses.items() if status[:1] not in '23')
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else None,
+        'statuses': dict(statuses),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 1) if elapsed else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(latencies[-1] if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def session_cookie(user):
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store[SESSION_KEY] = str(user.pk)
+    store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    store.save()
+    return f"{settings.SESSION_COOKIE_NAME}={store.session_key}"
+
+
+class RenditionScenario:
+    """GET renditions in sizes nobody asked for yet, so each one is rendered."""
+
+    def __init__(self):
+        self.photo = Photo.objects.order_by('pk').first()
+        if self.photo is None:
+            raise ValueError("The rendition scenario needs at least one photo")
+        # targets share the rendition cache, so every one gets its own sizes
+        self.next_size = random.randint(100, 1000)
+
+    def prepare(self, count):
+        sizes = range(self.next_size, self.next_size + count)
+        self.next_size += count
+        return [('GET', rendition_url(self.photo.pk, size, size), None, None) for size in sizes]
+
+    def cleanup(self):
+        pass
+
+
+class PaymentScenario:
+    """
+    POST a payment for a fresh single-photo order per request, each by its
+    own throwaway user, so every request reaches the payment provider.
+    """
+
+    def __init__(self):
+        self.photo = Photo.objects.order_by('pk').first()
+        if self.photo is None:
+            raise ValueError("The payment scenario needs at least one photo")
+        self.prefix = f"loadtest-{uuid.uuid4().hex[:8]}-"
+        self.started = timezone.localdate()
+        self.count = 0
+
+    def prepare(self, count):
+        requests = []
+        with transaction.atomic():
+            for i in range(self.count, self.count + count):
+                user = User.objects.create(username=f"{self.prefix}{i}", email=f"{self.prefix}{i}@example.com")
+                order = Order.objects.create(user=user, ordered_date=timezone.now())
+                order.photos.add(OrderPhoto.objects.create(user=user, photo=self.photo))
+                token = _get_new_csrf_token()
+                requests.append(('POST', '/payment/stripe/', urlencode({
+                    'idempotency_key': uuid.uuid4().hex,
+                    'stripeToken': 'tok_visa',
+                }), {
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Cookie': f"{session_cookie(user)}; {settings.CSRF_COOKIE_NAME}={token}",
+                    'X-CSRFToken': token,
+                }))
+        self.count += count
+        return requests
+
+    def paid(self):
+        return PaymentAttempt.objects.filter(
+            user__username__startswith=self.prefix, status=PaymentAttempt.SUCCEEDED).count()
+
+    def cleanup(self):
+        users = User.objects.filter(username__startswith=self.prefix)
+        Payment.objects.filter(order__user__in=users).delete()
+        users.delete()
+        # take the test purchases back out of the sales dashboard
+        sales.rebuild(since=self.started)
+
+
+SCENARIOS = {
+    'payment': PaymentScenario,
+    'rendition': RenditionScenario,
+}
+
+
+class Browser:
+    """One virtual user, keeping its cookies between requests like a browser."""
+
+    def __init__(self, base_url, cookie=''):
+        self.base_url = base_url
+        self.cookies = {name: morsel.value for name, morsel in SimpleCookie(cookie).items()}
+        self.cookies.setdefault(settings.CSRF_COOKIE_NAME, _get_new_csrf_token())
+
+    def request(self, method, path, data=None):
+        """Returns the status and the path redirected to, if any."""
+        headers = {'Cookie': '; '.join(f"{name}={value}" for name, value in self.cookies.items())}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.cookies[settings.CSRF_COOKIE_NAME]
+        status, response_headers = fetch(self.base_url, method, path, body, headers)
+        for header in response_headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                if morsel.value and morsel['max-age'] != '0':
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        return status, urlsplit(response_headers.get('Location', '')).path
+
+
+CHECKOUT_FORM = {
+    'shipping_address': '1 Load Test Street',
+    'shipping_country': 'US',
+    'shipping_zip': '10001',
+    'same_billing_address': 'on',
+    'payment_option': 'S',
+}
+
+
+def checkout_journey(slug, page):
+    """
+    The steps of a purchase as ``(name, method, path, data, redirect,
+    check)``; a step with a redirect only succeeds if it redirects there, the
+    others must answer 2xx. ``check``, if given, is called after a step that
+    passed and returns why it failed anyway, or None.
+    """
+    payment = reverse('imageapp:payment', kwargs={'payment_option': 'stripe'})
+    key = uuid.uuid4().hex
+    return [
+        ('list', 'GET', reverse('imageapp:photo-list'), None, None, None),
+        ('list_page', 'GET', reverse('imageapp:photo-list') + f"?sort=price-asc&page={page}", None, None,
+         None),
+        ('detail', 'GET', reverse('imageapp:photo-details', args=[slug]), None, None, None),
+        ('add_to_cart', 'GET', reverse('imageapp:add-to-cart', args=[slug]), None,
+         reverse('imageapp:order-summary'), None),
+        ('order_summary', 'GET', reverse('imageapp:order-summary'), None, None, None),
+        ('checkout', 'GET', reverse('imageapp:checkout'), None, None, None),
+        ('checkout_submit', 'POST', reverse('imageapp:checkout'), CHECKOUT_FORM, payment, None),
+        ('payment', 'GET', payment, None, None, None),
+        # declined and failed payments redirect to the photo list as well
+        ('pay', 'POST', payment, {'idempotency_key': key, 'stripeToken': 'tok_visa'},
+         reverse('imageapp:photo-list'), lambda: payment_status(key)),
+    ]
+
+
+def payment_status(key):
+    attempt = PaymentAttempt.objects.filter(key=key).values_list('status', 'message').first()
+    if attempt is None:
+        return "no payment attempt"
+    status, message = attempt
+    if status != PaymentAttempt.SUCCEEDED:
+        return f"payment {dict(PaymentAttempt.STATUS_CHOICES)[status].lower()}: {message}"
+    return None
+
+
+JOURNEY_STEPS = [name for name, *rest in checkout_journey('slug', 1)]
+
+
+def run_journeys(base_url, cookies, slugs, journeys, pages=1):
+    """
+    Run ``journeys`` checkout journeys, one virtual user per session cookie
+    in ``cookies`` running its journeys one after the other. A journey
+    stops at its first failed step. Returns a summary per step and overall.
+    """
+    results = defaultdict(list)
+    started = itertools.count()
+    completed = itertools.count()
+
+    def user(cookie):
+        browser = Browser(base_url, cookie)
+        try:
+            while next(started) < journeys:
+                for name, method, path, data, redirect, check in checkout_journey(
+                        random.choice(slugs), random.randint(1, pages)):
+                    start = time.perf_counter()
+                    try:
+                        status, location = browser.request(method, path, data)
+                    except (OSError, http.client.HTTPException) as e:
+                        status, location = type(e).__name__, ''
+                    latency = time.perf_counter() - start
+                    if status in (301, 302, 303) and location != redirect:
+                        # e.g. sent back to the form with a message
+                        status = f"unexpected {status} to {location}"
+                    elif check is not None and str(status).startswith(('2', '3')):
+                        status = check() or status
+                    results[name].append((status, latency))
+                    if not str(status).startswith(('2', '3')):
+                        break
+                else:
+                    next(completed)
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(cookies)) as pool:
+        list(pool.map(user, cookies))
+    elapsed = time.perf_counter() - start
+
+    done = next(completed)
+    return {
+        'journeys': {
+            'completed': done,
+            'seconds': round(elapsed, 3),
+            'per_second': round(done / elapsed, 2) if elapsed else None,
+        },
+        'steps': {name: summarize(results[name], elapsed) for name in JOURNEY_STEPS if results[name]},
+    }
+
+
+def seed_image(prefix):
+    """A JPEG in media storage that all seeded photos share."""
+    from PIL import Image
+
+    name = f"image_repository/{prefix}seed.jpg"
+    if not default_storage.exists(name):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), (70, 130, 180)).save(buffer, 'JPEG', quality=85)
+        name = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return name
+
+
+def seed(prefix, sellers, photos, buyers):
+    """Create sellers with photos, and buyers, all with usernames starting with ``prefix``."""
+    image = seed_image(prefix)
+    with transaction.atomic():
+        seller_users = [
+            User.objects.create(username=f"{prefix}seller-{i}", email=f"{prefix}seller-{i}@example.com")
+            for i in range(sellers)
+        ]
+        for i in range(photos):
+            price = random.choice([5, 10, 15, 20, 25, 40])
+            Photo.objects.create(
+                user=seller_users[i % sellers],
+                description=f"{prefix}photo {i}",
+                image=image,
+                price=price,
+                discount_price=price * 0.8 if i % 4 == 0 else None,
+            )
+        for i in range(buyers):
+            User.objects.create(username=f"{prefix}buyer-{i}", email=f"{prefix}buyer-{i}@example.com")
+
+
+def clear(prefix):
+    users = User.objects.filter(username__startswith=prefix)
+    Payment.objects.filter(order__user__in=users).delete()
+    # the sales aggregates of the seeded sellers go with them
+    return users.delete()[1].get('auth.User', 0)
+
+
+def seeded_buyers(prefix):
+    return User.objects.filter(username__startswith=f"{prefix}buyer-").order_by('pk')
+
+
+def seeded_photo_slugs(prefix):
+    return list(Photo.objects.filter(user__username__startswith=f"{prefix}seller-")
+                .values_list('slug', flat=True))
+
+
+def reset_carts(users):
+    """Drop the open orders of ``users`` so journeys start with an empty cart."""
+    OrderPhoto.objects.filter(user__in=users, ordered=False).delete()
+    Order.objects.filter(user__in=users, ordered=False).delete()
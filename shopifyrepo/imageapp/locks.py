@@ -0,0 +1,95 @@
+"""
+Cross-process single-flight coordination for derivative generation.
+
+A lock is an flock() on a file in ``SINGLE_FLIGHT_LOCK_DIR``, so it works
+between threads, gunicorn workers and management commands on the same host
+without any extra service. The kernel drops the lock when its holder exits
+or crashes, so a lock is never stale however long the render takes, and a
+file left behind is simply locked again by the next worker.
+"""
+import fcntl
+import hashlib
+import os
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+
+POLL_INTERVAL = 0.05
+
+
+def _lock_path(key):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(settings.SINGLE_FLIGHT_LOCK_DIR, digest + '.lock')
+
+
+def _acquire(path):
+    """An open file descriptor holding the lock, or None if somebody else has it."""
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # the holder removes the file before unlocking it, so if we locked
+        # a removed file, try again with the one at ``path`` now
+        try:
+            current = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            return fd
+        os.close(fd)
+
+
+def _release(path, fd):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    os.close(fd)
+
+
+def single_flight(name, key, lookup, produce, wait=None):
+    """
+    Return ``lookup()`` if it is not None, otherwise run ``produce()`` in at
+    most one thread or process per ``key`` and return its result.
+
+    Callers that lose the race poll ``lookup()`` for up to ``wait`` seconds
+    and get None if the result still isn't there, so they can fall back to
+    a placeholder. ``name`` prefixes the metrics counters.
+    """
+    if wait is None:
+        wait = settings.SINGLE_FLIGHT_WAIT
+    path = _lock_path(f"{name}:{key}")
+    deadline = time.monotonic() + wait
+    collapsed = False
+    while True:
+        result = lookup()
+        if result is not None:
+            return result
+        fd = _acquire(path)
+        if fd is not None:
+            try:
+                # somebody may have finished between our lookup and acquire
+                result = lookup()
+                if result is None:
+                    metrics.incr(f"{name}.generated")
+                    result = produce()
+                return result
+            finally:
+                _release(path, fd)
+        if not collapsed:
+            metrics.incr(f"{name}.collapsed")
+            collapsed = True
+        if time.monotonic() >= deadline:
+            metrics.incr(f"{name}.wait_timeouts")
+            return None
+        time.sleep(POLL_INTERVAL)
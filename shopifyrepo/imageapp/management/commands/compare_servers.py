@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from imageapp import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the same load to several running deployments of the shop and compare throughput "
+        "and tail latency. For example, with a slow payment provider:\n"
+        "  manage.py fake_stripe --delay 0.5\n"
+        "  STRIPE_API_BASE=http://127.0.0.1:12111 gunicorn -w 4 -b :8000 shopifyrepo.wsgi\n"
+        "  STRIPE_API_BASE=http://127.0.0.1:12111 uvicorn --workers 4 --port 8001 shopifyrepo.asgi:application\n"
+        "  manage.py compare_servers --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                            help="A deployment to test, can be repeated.")
+        parser.add_argument('--scenario', choices=list(loadtest.SCENARIOS), default='payment')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith('http://'):
+                raise CommandError(f"Expected NAME=http://host:port, got {target!r}")
+            targets.append((name, url.rstrip('/')))
+
+        try:
+            scenario = loadtest.SCENARIOS[options['scenario']]()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        results = {}
+        try:
+            for name, url in targets:
+                requests = scenario.prepare(options['requests'])
+                paid_before = scenario.paid() if hasattr(scenario, 'paid') else None
+                results[name] = loadtest.run(url, requests, options['concurrency'])
+                if paid_before is not None:
+                    results[name]['paid'] = scenario.paid() - paid_before
+                self.stdout.write(f"{name}: {json.dumps(results[name])}")
+        finally:
+            scenario.cleanup()
+
+        columns = ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'errors')
+        self.stdout.write("")
+        self.stdout.write(f"{'target':<12}" + "".join(f"{column:>10}" for column in columns))
+        for name, result in results.items():
+            self.stdout.write(f"{name:<12}" + "".join(f"{str(result[column]):>10}" for column in columns))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'scenario': options['scenario'], 'results': results}, f, indent=2)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from imageapp import templating
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile every template of the shop, report the slowest to parse and fail if any of "
+        "them has a syntax error or extends/includes a template that doesn't exist. Run it "
+        "before deploying; workers compile the same templates at boot when TEMPLATE_CACHE is on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Only these templates.")
+        parser.add_argument('--slowest', type=int, default=10,
+                            help="How many of the slowest templates to list.")
+
+    def handle(self, *args, **options):
+        timings, errors = templating.compile_templates(options['names'])
+
+        self.stdout.write(
+            f"{len(timings)} templates compiled in {sum(timings.values()) * 1000:.1f} ms"
+            f" ({'cached' if templating.is_cached() else 'not cached'} loader)"
+        )
+        slowest = sorted(timings.items(), key=lambda item: -item[1])[:options['slowest']]
+        for name, seconds in slowest:
+            self.stdout.write(f"  {seconds * 1000:>8.2f} ms  {name}")
+
+        if errors:
+            for name, error in errors.items():
+                self.stderr.write(f"{name}: {error}")
+            raise CommandError(f"{len(errors)} broken templates")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from imageapp import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the lines of paid orders with payment and address data as CSV or JSONL. "
+        "Rows are streamed, so memory stays flat however many orders there are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--start', type=exports.parse_day,
+                            help="First payment date to include (YYYY-MM-DD).")
+        parser.add_argument('--end', type=exports.parse_day,
+                            help="Last payment date to include (YYYY-MM-DD).")
+        parser.add_argument('--output', '-o', help="File to write to, defaults to stdout.")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Rows fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        chunks = exports.export(options['format'], options['start'], options['end'],
+                                options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
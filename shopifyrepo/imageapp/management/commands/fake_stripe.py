@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+DECLINED_TOKEN = 'tok_chargeDeclined'
+
+
+class FakeStripe:
+    """
+    In-memory stand-in for the parts of the Stripe API the shop uses:
+    customers, card sources and charges, with Idempotency-Key support.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.customers = {}
+        self.idempotent = {}
+        self.stats = Counter()
+
+    def handle(self, method, path, params, idempotency_key):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.stats['requests'] += 1
+            if idempotency_key:
+                cache_key = (method, path, idempotency_key)
+                if cache_key in self.idempotent:
+                    stored_params, response = self.idempotent[cache_key]
+                    if stored_params != params:
+                        return 400, error('idempotency_error', "Keys for idempotent requests can only "
+                                                               "be used with the same parameters.")
+                    self.stats['idempotent_replays'] += 1
+                    return response
+            response = self.route(method, path, params)
+            if idempotency_key and response[0] < 500:
+                self.idempotent[cache_key] = (params, response)
+            return response
+
+    def route(self, method, path, params):
+        parts = path.strip('/').split('/')
+        if parts[:1] != ['v1']:
+            return 404, error('invalid_request_error', "Unrecognized request URL.")
+        parts = parts[1:]
+        if method == 'POST' and parts == ['charges']:
+            return self.create_charge(params)
+        if method == 'POST' and parts == ['customers']:
+            return self.create_customer(params)
+        if len(parts) >= 2 and parts[0] == 'customers':
+            customer = self.customers.get(parts[1])
+            if customer is None:
+                return 404, error('invalid_request_error', f"No such customer: '{parts[1]}'")
+            if method == 'GET' and len(parts) == 2:
+                return 200, customer
+            if parts[2:] == ['sources']:
+                if method == 'POST':
+                    return self.create_source(customer, params)
+                return 200, customer['sources']
+        return 404, error('invalid_request_error', "Unrecognized request URL.")
+
+    def create_customer(self, params):
+        customer_id = 'cus_' + uuid.uuid4().hex[:14]
+        customer = {
+            'id': customer_id,
+            'object': 'customer',
+            'email': params.get('email'),
+            'sources': {
+                'object': 'list',
+                'data': [],
+                'has_more': False,
+                'url': f'/v1/customers/{customer_id}/sources',
+            },
+        }
+        self.customers[customer_id] = customer
+        self.stats['customers'] += 1
+        return 200, customer
+
+    def create_source(self, customer, params):
+        if params.get('source') == DECLINED_TOKEN:
+            return 402, error('card_error', "Your card was declined.", code='card_declined')
+        card = {
+            'id': 'card_' + uuid.uuid4().hex[:14],
+            'object': 'card',
+            'brand': 'Visa',
+            'last4': '4242',
+            'exp_month': 12,
+            'exp_year': 2030,
+            'customer': customer['id'],
+        }
+        customer['sources']['data'].insert(0, card)
+        return 200, card
+
+    def create_charge(self, params):
+        source = params.get('source')
+        customer = params.get('customer')
+        if source == DECLINED_TOKEN:
+            self.stats['declined'] += 1
+            return 402, error('card_error', "Your card was declined.", code='card_declined')
+        if customer and customer not in self.customers:
+            return 400, error('invalid_request_error', f"No such customer: '{customer}'")
+        if not (source or customer):
+            return 400, error('invalid_request_error', "Must provide source or customer.")
+        self.stats['charges'] += 1
+        self.stats['charged_amount'] += int(params.get('amount', 0))
+        return 200, {
+            'id': 'ch_' + uuid.uuid4().hex[:14],
+            'object': 'charge',
+            'amount': int(params.get('amount', 0)),
+            'currency': params.get('currency', 'usd'),
+            'customer': customer,
+            'paid': True,
+            'status': 'succeeded',
+        }
+
+
+def error(error_type, message, code=None):
+    body = {'type': error_type, 'message': message}
+    if code:
+        body['code'] = code
+    return {'error': body}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/_stats':
+                return self.respond(200, dict(api.stats))
+            self.dispatch('GET', url.path, dict(parse_qsl(url.query)))
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode()
+            self.dispatch('POST', url.path, dict(parse_qsl(body)))
+
+        def dispatch(self, method, path, params):
+            status, body = api.handle(method, path, params, self.headers.get('Idempotency-Key'))
+            self.respond(status, body)
+
+        def respond(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Request-Id', 'req_' + uuid.uuid4().hex[:14])
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local fake Stripe API server for development and load tests. "
+        "Point the shop at it with STRIPE_API_BASE=http://<addr>:<port>. "
+        f"Charging the token '{DECLINED_TOKEN}' is declined; GET /_stats returns counters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addr', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help="Seconds to sleep in every request, to simulate a slow provider.")
+
+    def handle(self, *args, **options):
+        api = FakeStripe(delay=options['delay'])
+        server = ThreadingHTTPServer((options['addr'], options['port']), make_handler(api))
+        self.stdout.write(f"Fake Stripe API listening on http://{options['addr']}:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(json.dumps(dict(api.stats)))
@@ -0,0 +1,184 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from easy_thumbnails.models import Source, Thumbnail
+
+from imageapp.media_gc import (
+    THUMBNAIL_RE, batches, delete_renditions, file_size, scan_directory, thumbnail_box,
+)
+from imageapp.models import Photo
+from imageapp.renditions import source_digest
+
+
+PHASES = ('uploads', 'renditions')
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete unreferenced photo originals, stale thumbnails and renditions. "
+        "Scans in batches and checkpoints its progress so it can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Files (or rendition directories) checked per database query.")
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between batches to limit I/O load.")
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Never touch files modified less than this many seconds ago.")
+        parser.add_argument('--state-file', default=str(settings.BASE_DIR / '.gc_media.json'),
+                            help="Where progress is checkpointed between runs.")
+        parser.add_argument('--reset', action='store_true',
+                            help="Ignore any saved checkpoint and start from the beginning.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.min_age = options['min_age']
+        self.state_file = options['state_file']
+        self.now = time.time()
+        self.files = 0
+        self.reclaimed = 0
+
+        state = {} if options['reset'] else self.load_state()
+        phase = state.get('phase', PHASES[0])
+        after = state.get('after', '')
+
+        for current in PHASES[PHASES.index(phase):]:
+            scan = self.scan_uploads if current == 'uploads' else self.scan_renditions
+            for last in scan(after, options['batch_size']):
+                if not self.dry_run:
+                    self.save_state({'phase': current, 'after': last})
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            after = ''
+
+        if not self.dry_run and os.path.exists(self.state_file):
+            os.unlink(self.state_file)
+
+        verb = "Would reclaim" if self.dry_run else "Reclaimed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.reclaimed} bytes in {self.files} files."
+        ))
+
+    def load_state(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        self.stdout.write(f"Resuming {state['phase']} after {state['after']!r}")
+        return state
+
+    def save_state(self, state):
+        with open(self.state_file, 'w') as f:
+            json.dump(state, f)
+
+    def is_recent(self, path):
+        try:
+            return self.now - os.stat(path).st_mtime < self.min_age
+        except FileNotFoundError:
+            return True
+
+    def report(self, path, size, reason):
+        self.files += 1
+        self.reclaimed += size
+        if self.verbosity > 1 or self.dry_run:
+            self.stdout.write(f"{reason}: {path} ({size} bytes)")
+
+    def scan_uploads(self, after, batch_size):
+        upload_to = Photo._meta.get_field('image').upload_to
+        directory = os.path.join(settings.MEDIA_ROOT, upload_to)
+        if not os.path.isdir(directory):
+            return
+        # streamed in directory order, so only one batch is held in memory;
+        # the checkpoint is the last file of a batch that is still there
+        checkpoint = after
+        names = (entry.name for entry in scan_directory(directory, after) if entry.is_file())
+        for batch in batches(names, batch_size):
+            matches = {name: THUMBNAIL_RE.match(name) for name in batch}
+            lookup = {f"{upload_to}/{name}" for name in batch}
+            lookup.update(f"{upload_to}/{m.group('source')}" for m in matches.values() if m)
+            croppings = dict(Photo.objects.filter(image__in=lookup).values_list('image', 'cropping'))
+
+            originals, thumbnails, removed = [], [], set()
+            for name in batch:
+                path = os.path.join(directory, name)
+                image_name = f"{upload_to}/{name}"
+                if image_name in croppings or self.is_recent(path):
+                    continue
+                match = matches[name]
+                if match is None:
+                    reason = "unreferenced original"
+                    originals.append(image_name)
+                else:
+                    source_name = f"{upload_to}/{match.group('source')}"
+                    box = thumbnail_box(match.group('options'))
+                    if source_name not in croppings:
+                        reason = "orphaned thumbnail"
+                    elif box is not None and box != croppings[source_name]:
+                        reason = "stale thumbnail"
+                    else:
+                        continue
+                    thumbnails.append(image_name)
+                size = file_size(path)
+                self.report(path, size, reason)
+                if not self.dry_run:
+                    removed.add(name)
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+
+            if not self.dry_run:
+                if thumbnails:
+                    Thumbnail.objects.filter(name__in=thumbnails).delete()
+                if originals:
+                    Source.objects.filter(name__in=originals).delete()
+            checkpoint = next((name for name in reversed(batch) if name not in removed), checkpoint)
+            yield checkpoint
+
+    def scan_renditions(self, after, batch_size):
+        directory = settings.RENDITION_CACHE_DIR
+        if not os.path.isdir(directory):
+            return
+        checkpoint = after
+        names = (entry.name for entry in scan_directory(directory, after)
+                 if entry.is_dir() and entry.name.isdigit())
+        for chunk in batches(names, batch_size):
+            batch = [int(name) for name in chunk]
+            removed = set()
+            digests = {
+                pk: source_digest(image, cropping)
+                for pk, image, cropping in Photo.objects.filter(pk__in=batch).values_list(
+                    'pk', 'image', 'cropping')
+            }
+            for pk in batch:
+                path = os.path.join(directory, str(pk))
+                if pk not in digests:
+                    size = sum(file_size(entry.path) for entry in os.scandir(path))
+                    self.report(path, size, "renditions of deleted photo")
+                    if not self.dry_run:
+                        removed.add(pk)
+                        delete_renditions(pk)
+                    continue
+                with os.scandir(path) as entries:
+                    files = [entry.path for entry in entries if entry.is_file()]
+                for file_path in files:
+                    # "<w>x<h>-<digest>.<ext>"
+                    digest = os.path.splitext(os.path.basename(file_path))[0].rpartition('-')[2]
+                    if digest == digests[pk] or self.is_recent(file_path):
+                        continue
+                    self.report(file_path, file_size(file_path), "stale rendition")
+                    if not self.dry_run:
+                        try:
+                            os.unlink(file_path)
+                        except FileNotFoundError:
+                            pass
+            checkpoint = next((str(pk) for pk in reversed(batch) if pk not in removed), checkpoint)
+            yield checkpoint
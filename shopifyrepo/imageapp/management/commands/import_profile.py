@@ -0,0 +1,114 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# what a worker does before it can serve its first request
+BOOT = """
+import time
+start = time.perf_counter()
+from shopifyrepo.{entry} import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(round((time.perf_counter() - start) * 1000, 1))
+"""
+
+# imported on first use, see e.g. imageapp/payments.py; booting must not pull them in
+LAZY_MODULES = ('stripe',)
+
+
+def parse_importtime(output):
+    """``-X importtime`` stderr -> list of (module, self us, cumulative us, depth)."""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile worker boot: time loading the WSGI/ASGI application and URLconf in a fresh "
+        "interpreter and break the imports down with python -X importtime. Exits with an error "
+        "if boot takes longer than --max-ms or imports a module that should load lazily, so it "
+        "can guard against startup regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--runs', type=int, default=5,
+                            help="Timed boots; the median is reported.")
+        parser.add_argument('--top', type=int, default=20,
+                            help="How many packages and modules to list.")
+        parser.add_argument('--max-ms', type=float,
+                            help="Fail if the median boot time is above this.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def boot(self, entry, importtime=False):
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', BOOT.format(entry=entry)]
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'shopifyrepo.settings'))
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"Booting {entry} failed:\n{result.stderr[-2000:]}")
+        return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        entry = options['entry']
+        timings = [self.boot(entry)[0] for _ in range(options['runs'])]
+        boot_ms = statistics.median(timings)
+        modules = parse_importtime(self.boot(entry, importtime=True)[1])
+
+        packages = defaultdict(int)
+        for name, self_us, cumulative_us, depth in modules:
+            packages[name.split('.')[0]] += self_us
+        lazy = sorted({name for name, *rest in modules if name.split('.')[0] in LAZY_MODULES})
+
+        report = {
+            'entry': entry,
+            'boot_ms': boot_ms,
+            'runs_ms': timings,
+            'modules': len(modules),
+            'packages_ms': {
+                name: round(us / 1000, 1)
+                for name, us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]
+            },
+            'slowest_ms': {
+                name: round(cumulative_us / 1000, 1)
+                for name, self_us, cumulative_us, depth in sorted(
+                    modules, key=lambda module: -module[2])[:options['top']]
+            },
+            'eager_lazy_modules': lazy,
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"{entry} boot: {boot_ms} ms median of {timings}, {len(modules)} modules")
+            self.stdout.write("\nself time by top-level package (ms):")
+            for name, ms in report['packages_ms'].items():
+                self.stdout.write(f"  {ms:>8}  {name}")
+            self.stdout.write("\nslowest imports, cumulative (ms):")
+            for name, ms in report['slowest_ms'].items():
+                self.stdout.write(f"  {ms:>8}  {name}")
+
+        problems = []
+        if lazy:
+            problems.append("imported at boot but should load lazily: " + ", ".join(lazy))
+        if options['max_ms'] is not None and boot_ms > options['max_ms']:
+            problems.append(f"boot took {boot_ms} ms, the budget is {options['max_ms']} ms")
+        if problems:
+            raise CommandError("; ".join(problems))
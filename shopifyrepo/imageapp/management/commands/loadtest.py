@@ -0,0 +1,120 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from imageapp import loadtest
+from imageapp.management.commands.fake_stripe import FakeStripe, make_handler
+from imageapp.models import PaymentAttempt
+
+
+class Command(BaseCommand):
+    help = (
+        "Run checkout journeys (list, photo, add to cart, order summary, checkout, payment) "
+        "against a running shop and report throughput, latency percentiles and error rates "
+        "per step. For example:\n"
+        "  manage.py seed_loadtest\n"
+        "  RATELIMIT_ENABLED=0 STRIPE_API_BASE=http://127.0.0.1:12111 gunicorn -w 4 -b :8000 shopifyrepo.wsgi\n"
+        "  manage.py loadtest --url http://127.0.0.1:8000 --fake-stripe 12111 --concurrency 8 "
+        "--save-baseline loadtest_baseline.json\n"
+        "and later, to catch regressions:\n"
+        "  manage.py loadtest --url http://127.0.0.1:8000 --fake-stripe 12111 --concurrency 8 "
+        "--baseline loadtest_baseline.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', required=True, help="The shop under test, http://host:port")
+        parser.add_argument('--prefix', default='loadseed-', help="As given to seed_loadtest.")
+        parser.add_argument('--journeys', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help="Virtual users, each with its own seeded buyer.")
+        parser.add_argument('--pages', type=int, default=5,
+                            help="List pages the journeys browse.")
+        parser.add_argument('--fake-stripe', type=int, metavar='PORT',
+                            help="Serve a fake Stripe API on this port while the test runs.")
+        parser.add_argument('--baseline', help="Fail if the results are worse than this file's.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed slowdown against the baseline, 0.25 is 25%%.")
+        parser.add_argument('--save-baseline', help="Write the results to this file.")
+
+    def handle(self, *args, **options):
+        if not options['url'].startswith('http://'):
+            raise CommandError("--url must be http://host:port")
+        buyers = list(loadtest.seeded_buyers(options['prefix'])[:options['concurrency']])
+        slugs = loadtest.seeded_photo_slugs(options['prefix'])
+        if len(buyers) < options['concurrency'] or not slugs:
+            raise CommandError(
+                f"Found {len(buyers)} buyers and {len(slugs)} photos with prefix "
+                f"{options['prefix']!r}; run seed_loadtest with --buyers {options['concurrency']}"
+            )
+
+        server = None
+        if options['fake_stripe']:
+            server = ThreadingHTTPServer(('127.0.0.1', options['fake_stripe']), make_handler(FakeStripe()))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        loadtest.reset_carts(buyers)
+        started = timezone.now()
+        try:
+            results = loadtest.run_journeys(
+                options['url'].rstrip('/'), [loadtest.session_cookie(buyer) for buyer in buyers],
+                slugs, options['journeys'], options['pages'])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        attempts = PaymentAttempt.objects.filter(user__in=buyers, created__gte=started)
+        results['payments'] = {
+            'succeeded': attempts.filter(status=PaymentAttempt.SUCCEEDED).count(),
+            'failed': attempts.filter(status=PaymentAttempt.FAILED).count(),
+        }
+        self.report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            problems = compare(results, baseline, options['tolerance'])
+            if problems:
+                raise CommandError("Regressed against the baseline:\n  " + "\n  ".join(problems))
+            self.stdout.write("Within the baseline.")
+
+    def report(self, results):
+        journeys = results['journeys']
+        self.stdout.write(
+            f"{journeys['completed']} journeys completed in {journeys['seconds']} s "
+            f"({journeys['per_second']}/s), payments {results['payments']}"
+        )
+        columns = ('requests', 'rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms')
+        self.stdout.write(f"{'step':<16}" + "".join(f"{column:>11}" for column in columns))
+        for name, step in results['steps'].items():
+            self.stdout.write(f"{name:<16}" + "".join(f"{str(step[column]):>11}" for column in columns))
+        for name, step in results['steps'].items():
+            if step['errors']:
+                self.stdout.write(f"{name} errors: {step['statuses']}")
+
+
+def compare(results, baseline, tolerance):
+    problems = []
+    if results['payments']['failed'] > baseline['payments']['failed']:
+        problems.append(f"{results['payments']['failed']} failed payments, "
+                        f"baseline {baseline['payments']['failed']}")
+    per_second, was = results['journeys']['per_second'], baseline['journeys']['per_second']
+    if per_second < was * (1 - tolerance):
+        problems.append(f"{per_second} journeys/s, baseline {was}")
+    for name, was in baseline['steps'].items():
+        step = results['steps'].get(name)
+        if step is None:
+            problems.append(f"{name}: not reached")
+            continue
+        if step['error_rate'] > was['error_rate'] + 0.01:
+            problems.append(f"{name}: error rate {step['error_rate']}, baseline {was['error_rate']}")
+        # p99 of a short run is too noisy to gate on
+        if step['p95_ms'] > was['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {step['p95_ms']} ms, baseline {was['p95_ms']} ms")
+    return problems
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from imageapp import sales
+from imageapp.models import PhotoSalesDaily, UserSalesDaily
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales aggregates behind the sales dashboard from paid orders. "
+        "Use it after importing orders or changing how revenue is counted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help="Only rebuild days from this date (YYYY-MM-DD) on.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sales.rebuild(since=options['since'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f"{PhotoSalesDaily.objects.count()} photo-days, "
+            f"{UserSalesDaily.objects.count()} seller-days"
+        )
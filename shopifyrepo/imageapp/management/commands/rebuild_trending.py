@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from imageapp import popularity
+from imageapp.models import PhotoPopularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the trending scores from the hourly popularity counters, e.g. after "
+        "changing POPULARITY_WEIGHTS or TRENDING_HALF_LIFE. Optionally drop old counters first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune-days', type=int,
+                            help="Delete counters older than this many days before rebuilding.")
+
+    def handle(self, *args, **options):
+        if options['prune_days'] is not None:
+            before = timezone.now() - timedelta(days=options['prune_days'])
+            deleted, _ = PhotoPopularity.objects.filter(bucket__lt=before).delete()
+            self.stdout.write(f"{deleted} old counters deleted")
+        photos = popularity.rebuild()
+        self.stdout.write(f"{photos} photos scored")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from imageapp import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the sellers, photos and buyers `manage.py loadtest` runs its journeys with, "
+        "or delete them again with --clear. Every seeded user's name starts with --prefix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='loadseed-')
+        parser.add_argument('--sellers', type=int, default=10)
+        parser.add_argument('--photos', type=int, default=200)
+        parser.add_argument('--buyers', type=int, default=50,
+                            help="One per concurrent virtual user.")
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete the seeded data (and everything it bought) instead.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['clear']:
+            self.stdout.write(f"{loadtest.clear(prefix)} seeded users deleted")
+            return
+        if loadtest.seeded_buyers(prefix).exists():
+            raise CommandError(f"Data with prefix {prefix!r} exists already, --clear it first")
+        if options['sellers'] < 1 or options['photos'] < 1 or options['buyers'] < 1:
+            raise CommandError("Seed at least one seller, photo and buyer")
+        loadtest.seed(prefix, options['sellers'], options['photos'], options['buyers'])
+        self.stdout.write(
+            f"Seeded {options['sellers']} sellers, {options['photos']} photos "
+            f"and {options['buyers']} buyers"
+        )
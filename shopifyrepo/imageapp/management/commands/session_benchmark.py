@@ -0,0 +1,102 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from imageapp.models import Photo
+
+
+# the stock setup before imageapp.sessions and cookie messages
+BASELINE = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'SESSION_MIDDLEWARE': 'django.contrib.sessions.middleware.SessionMiddleware',
+}
+BACKENDS = ('db', 'cached_db', 'signed_cookies')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what sessions and flash messages cost the cart endpoints: run the add, "
+        "remove and summary views with the stock session setup and with each session backend "
+        "and report queries (and session table queries) per request. Nothing is kept in the "
+        "database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20,
+                            help="How many times each cart round trip is repeated.")
+        parser.add_argument('--backend', action='append', choices=BACKENDS,
+                            help="Session backend to compare with the baseline, can be repeated.")
+
+    def handle(self, *args, **options):
+        photo = Photo.objects.order_by('pk').first()
+        if photo is None:
+            raise CommandError("The benchmark needs at least one photo")
+
+        configurations = [('baseline', BASELINE)]
+        for backend in options['backend'] or BACKENDS:
+            configurations.append((backend, {
+                'SESSION_ENGINE': 'django.contrib.sessions.backends.' + backend,
+                'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+                'SESSION_MIDDLEWARE': 'imageapp.sessions.SessionMiddleware',
+            }))
+
+        columns = ('visitor', 'requests', 'queries/req', 'session/req', 'ms/req')
+        self.stdout.write(f"{'setup':<16}" + "".join(f"{column:>14}" for column in columns))
+        for name, configuration in configurations:
+            for visitor in ('anonymous', 'logged in'):
+                result = self.measure(configuration, photo, visitor == 'logged in', options['rounds'])
+                self.stdout.write(f"{name:<16}{visitor:>14}" + "".join(
+                    f"{value:>14}" for value in result))
+
+    def measure(self, configuration, photo, logged_in, rounds):
+        middleware = [
+            configuration['SESSION_MIDDLEWARE'] if 'SessionMiddleware' in entry else entry
+            for entry in settings.MIDDLEWARE
+        ]
+        urls = [
+            reverse('imageapp:add-to-cart', args=[photo.slug]),
+            reverse('imageapp:add-to-cart', args=[photo.slug]),
+            reverse('imageapp:remove-single-item-from-cart', args=[photo.slug]),
+            reverse('imageapp:order-summary'),
+            reverse('imageapp:remove-from-cart', args=[photo.slug]),
+        ]
+        with override_settings(
+            SESSION_ENGINE=configuration['SESSION_ENGINE'],
+            MESSAGE_STORAGE=configuration['MESSAGE_STORAGE'],
+            MIDDLEWARE=middleware,
+            ALLOWED_HOSTS=['testserver'],
+            RATELIMIT_ENABLED=False,
+        ), transaction.atomic():
+            client = Client()
+            if logged_in:
+                user = User.objects.create(username=f"sessionbench-{uuid.uuid4().hex[:8]}")
+                client.force_login(user)
+            # warm up caches and lazy imports outside the measurement
+            client.get(reverse('imageapp:order-summary'))
+
+            requests = queries = session_queries = 0
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for url in urls:
+                    with CaptureQueriesContext(connection) as captured:
+                        client.get(url)
+                    requests += 1
+                    queries += len(captured)
+                    session_queries += sum('django_session' in query['sql'] for query in captured)
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+
+        return (
+            requests,
+            round(queries / requests, 2),
+            round(session_queries / requests, 2),
+            round(elapsed * 1000 / requests, 2),
+        )
@@ -0,0 +1,84 @@
+"""
+Cleanup of photo originals and their derivatives.
+
+``delete_photo_files`` is scheduled from the Photo delete/edit signals once
+the transaction commits; anything those hooks miss (crashes, files written
+before this existed) is found later by ``manage.py gc_media``.
+"""
+import itertools
+import logging
+import os
+import re
+import shutil
+
+from django.core.files.storage import default_storage
+from easy_thumbnails.models import Source, Thumbnail
+from easy_thumbnails.storage import thumbnail_default_storage
+
+from .renditions import rendition_dir
+
+
+logger = logging.getLogger(__name__)
+
+# easy_thumbnails names thumbnails "<source>.<options>.<ext>", e.g.
+# "photo.jpg.215x180_q85_box-210,0,1070,720_crop_detail.jpg"
+THUMBNAIL_RE = re.compile(r'^(?P<source>.+?\.\w+)\.(?P<options>\d+x\d+[^.]*)\.\w+$')
+
+
+def thumbnail_box(options):
+    for option in options.split('_'):
+        if option.startswith('box-'):
+            return option[len('box-'):]
+    return None
+
+
+def delete_renditions(pk):
+    shutil.rmtree(rendition_dir(pk), ignore_errors=True)
+
+
+def delete_photo_files(pk, image_name, delete_original=True):
+    """Delete the thumbnails and renditions of a photo, and optionally its original."""
+    try:
+        if image_name:
+            thumbnails = Thumbnail.objects.filter(source__name=image_name)
+            for name in thumbnails.values_list('name', flat=True):
+                thumbnail_default_storage.delete(name)
+            thumbnails.delete()
+            if delete_original:
+                default_storage.delete(image_name)
+                Source.objects.filter(name=image_name).delete()
+        delete_renditions(pk)
+    except Exception:
+        # gc_media will pick up whatever is left behind
+        logger.exception("Could not clean up files of photo %s", pk)
+
+
+def scan_directory(directory, after=''):
+    """
+    Entries of ``directory`` streamed in directory order, resuming after the
+    entry named ``after``, or from the start if that entry is gone.
+    """
+    if after:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name == after:
+                    yield from entries
+                    return
+    with os.scandir(directory) as entries:
+        yield from entries
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def file_size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
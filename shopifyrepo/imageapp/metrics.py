@@ -0,0 +1,27 @@
+"""
+Process-local counters.
+
+Every worker keeps its own counters; ``snapshot()`` is served by the staff
+metrics view so a scraper can sum them across workers.
+"""
+import threading
+from collections import Counter
+
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
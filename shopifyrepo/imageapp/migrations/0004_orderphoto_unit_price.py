@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0003_auto_20210113_1852'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderphoto',
+            name='unit_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:38
+
+from django.db import migrations, models
+
+
+def rename_duplicate_codes(apps, schema_editor):
+    # codes become unique; keep the oldest coupon of each code and give the
+    # others a code derived from their pk so the constraint can be added
+    Coupon = apps.get_model('imageapp', 'Coupon')
+    seen = set()
+    for coupon in Coupon.objects.order_by('pk'):
+        if coupon.code in seen:
+            suffix = f"-{coupon.pk}"
+            coupon.code = coupon.code[:15 - len(suffix)] + suffix
+            coupon.save(update_fields=['code'])
+        seen.add(coupon.code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0005_paymentattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='times_used',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(rename_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('imageapp', '0006_coupon_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSalesDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User sales daily',
+            },
+        ),
+        migrations.CreateModel(
+            name='PhotoSalesDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='imageapp.photo')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Photo sales daily',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usersalesdaily',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_user_sales_day'),
+        ),
+        migrations.AddIndex(
+            model_name='photosalesdaily',
+            index=models.Index(fields=['seller', 'date'], name='imageapp_ph_seller__138684_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='photosalesdaily',
+            constraint=models.UniqueConstraint(fields=('photo', 'date'), name='unique_photo_sales_day'),
+        ),
+    ]
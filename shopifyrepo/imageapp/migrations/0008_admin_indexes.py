@@ -0,0 +1,35 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0007_sales_daily'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_charge_id',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered', 'ordered_date'], name='imageapp_or_ordered_ad976c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['being_delivered', 'received'], name='imageapp_or_being_d_e71dda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderphoto',
+            index=models.Index(fields=['user', 'ordered'], name='imageapp_or_user_id_06ee32_idx'),
+        ),
+    ]
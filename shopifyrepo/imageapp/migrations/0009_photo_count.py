@@ -0,0 +1,33 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:51
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_photos(apps, schema_editor):
+    Photo = apps.get_model('imageapp', 'Photo')
+    UserProfile = apps.get_model('imageapp', 'UserProfile')
+    counts = Photo.objects.filter(user=OuterRef('user')).order_by().values('user').annotate(
+        count=Count('pk')).values('count')
+    UserProfile.objects.update(photo_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0008_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['user', 'id'], name='imageapp_ph_user_id_db6426_idx'),
+        ),
+        migrations.RunPython(count_photos, migrations.RunPython.noop),
+    ]
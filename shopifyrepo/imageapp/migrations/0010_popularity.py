@@ -0,0 +1,42 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0009_photo_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoTrending',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='imageapp.photo')),
+                ('score', models.FloatField(db_index=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Photo trending',
+            },
+        ),
+        migrations.CreateModel(
+            name='PhotoPopularity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('carts', models.PositiveIntegerField(default=0)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='imageapp.photo')),
+            ],
+            options={
+                'verbose_name_plural': 'Photo popularity',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='photopopularity',
+            constraint=models.UniqueConstraint(fields=('photo', 'bucket'), name='unique_photo_popularity_bucket'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.5 on 2026-10-19 07:58
+
+from django.db import migrations, models
+from django.db.models import Case, F, Q, Value, When
+import django.utils.timezone
+
+
+def derive_prices(apps, schema_editor):
+    Photo = apps.get_model('imageapp', 'Photo')
+    Photo.objects.update(effective_price=Case(
+        When(Q(discount_price__isnull=True) | Q(discount_price=0), then=F('price')),
+        default=F('discount_price'),
+    ))
+    Photo.objects.exclude(price=0).update(
+        discount_percent=(F('price') - F('effective_price')) / F('price') * Value(100.0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imageapp', '0010_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='discount_percent',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='effective_price',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['created_at', 'id'], name='imageapp_ph_created_6e834b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['effective_price', 'id'], name='imageapp_ph_effecti_57edc8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['discount_percent', 'id'], name='imageapp_ph_discoun_727ba1_idx'),
+        ),
+        migrations.RunPython(derive_prices, migrations.RunPython.noop),
+    ]
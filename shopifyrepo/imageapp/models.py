@@ -1,11 +1,17 @@
 from django.db import models
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from image_cropping import ImageRatioField, ImageCropField
 from django_countries.fields import CountryField
+from .media_gc import delete_photo_files
+from .renditions import rendition_url
 
 
 
@@ -19,6 +25,8 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     stripe_customer_id = models.CharField(max_length=50, blank=True, null=True)
     one_click_purchasing = models.BooleanField(default=False)
+    # kept up to date by the photo count receivers, shown on the user's gallery
+    photo_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -39,13 +47,26 @@ class Photo(models.Model):
     price = models.FloatField()
     discount_price = models.FloatField(blank=True, null=True)
     slug = models.SlugField(null=False, unique=True)
-    
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # derived from price and discount_price in save() so the catalogue can
+    # be sorted on them by index; queryset.update() must set them as well
+    effective_price = models.FloatField(default=0, editable=False)
+    discount_percent = models.FloatField(default=0, editable=False)
+
     def __str__(self):
         return self.description
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.description)
+        # same rule as OrderPhoto.get_final_price: an unset or zero discount is ignored
+        self.effective_price = self.discount_price or self.price
+        self.discount_percent = (
+            (self.price - self.effective_price) / self.price * 100 if self.price else 0
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'discount_price'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'effective_price', 'discount_percent'}
         return super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -63,6 +84,71 @@ class Photo(models.Model):
             'slug': self.slug
         })
 
+    def get_rendition_url(self, width, height, fmt='jpeg'):
+        return rendition_url(self.pk, width, height, fmt)
+
+    class Meta:
+        indexes = [
+            # the user gallery pages through a user's photos by pk
+            models.Index(fields=['user', 'id']),
+            # PhotoListView's sort orders, read forwards or backwards
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['effective_price', 'id']),
+            models.Index(fields=['discount_percent', 'id']),
+        ]
+
+def photo_delete_receiver(sender, instance, *args, **kwargs):
+    pk, image_name = instance.pk, instance.image.name
+    shared = Photo.objects.filter(image=image_name).exists()
+    transaction.on_commit(lambda: delete_photo_files(pk, image_name, delete_original=not shared))
+
+post_delete.connect(photo_delete_receiver, sender=Photo)
+
+def photo_edit_receiver(sender, instance, *args, **kwargs):
+    if instance._state.adding:
+        return
+    old = Photo.objects.filter(pk=instance.pk).values_list('image', 'cropping', 'user_id').first()
+    if old is None:
+        return
+    pk, (image_name, cropping, user_id) = instance.pk, old
+    # for photo_saved_count_receiver, which moves the photo between galleries
+    instance._previous_user_id = user_id
+    if image_name != instance.image.name:
+        shared = Photo.objects.filter(image=image_name).exclude(pk=pk).exists()
+        transaction.on_commit(lambda: delete_photo_files(pk, image_name, delete_original=not shared))
+    elif cropping != instance.cropping:
+        transaction.on_commit(lambda: delete_photo_files(pk, image_name, delete_original=False))
+
+pre_save.connect(photo_edit_receiver, sender=Photo)
+
+def photo_saved_count_receiver(sender, instance, created, *args, **kwargs):
+    previous_user_id = instance.__dict__.pop('_previous_user_id', None)
+    moved = not created and previous_user_id not in (None, instance.user_id)
+    if created or moved:
+        UserProfile.objects.filter(user_id=instance.user_id).update(
+            photo_count=F('photo_count') + 1)
+    if moved:
+        UserProfile.objects.filter(user_id=previous_user_id, photo_count__gt=0).update(
+            photo_count=F('photo_count') - 1)
+
+post_save.connect(photo_saved_count_receiver, sender=Photo)
+
+def photo_deleted_count_receiver(sender, instance, *args, **kwargs):
+    UserProfile.objects.filter(user_id=instance.user_id, photo_count__gt=0).update(
+        photo_count=F('photo_count') - 1)
+
+post_delete.connect(photo_deleted_count_receiver, sender=Photo)
+
+
+
+def current_photo_price():
+    # same rule as OrderPhoto.get_final_price: an unset or zero discount is ignored
+    return Case(
+        When(Q(photo__discount_price__isnull=True) | Q(photo__discount_price=0), then=F('photo__price')),
+        default=F('photo__discount_price'),
+        output_field=models.FloatField(),
+    )
+
 
 
 class OrderPhoto(models.Model):
@@ -70,6 +156,8 @@ class OrderPhoto(models.Model):
     ordered = models.BooleanField(default=False)
     photo = models.ForeignKey(Photo, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+    # price per unit frozen when the order is paid
+    unit_price = models.FloatField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.quantity} of {self.photo.description}"
@@ -84,10 +172,17 @@ class OrderPhoto(models.Model):
         return self.get_total_item_price() - self.get_total_discount_item_price()
 
     def get_final_price(self):
+        if self.unit_price is not None:
+            return self.quantity * self.unit_price
         if self.photo.discount_price:
             return self.get_total_discount_item_price()
         return self.get_total_item_price()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'ordered']),
+        ]
+
 
 
 class Order(models.Model):
@@ -106,33 +201,172 @@ class Order(models.Model):
     def __str__(self):
         return self.user.username
 
-    def get_total(self):
-        total = 0
-        for order_item in self.photos.all():
-            total += order_item.get_final_price()
+    def get_line_prices(self):
+        """Return ``{order photo pk: (unit price, quantity)}`` in one query."""
+        lines = self.photos.annotate(
+            line_price=Coalesce('unit_price', current_photo_price())
+        ).values_list('pk', 'line_price', 'quantity')
+        return {pk: (price, quantity) for pk, price, quantity in lines}
+
+    def get_total(self, line_prices=None):
+        if line_prices is None:
+            total = self.photos.aggregate(total=Sum(
+                F('quantity') * Coalesce('unit_price', current_photo_price()),
+                output_field=models.FloatField(),
+            ))['total'] or 0
+        else:
+            total = sum(price * quantity for price, quantity in line_prices.values())
         if self.coupon:
             total -= self.coupon.amount
         return total
 
+    def finalize(self, payment, line_prices):
+        """
+        Mark the order and all of its photos as ordered, freezing the unit
+        prices the customer was charged, in two UPDATE statements.
+        """
+        with transaction.atomic():
+            if line_prices:
+                self.photos.update(ordered=True, unit_price=Case(
+                    *[When(pk=pk, then=Value(price)) for pk, (price, quantity) in line_prices.items()],
+                    output_field=models.FloatField(),
+                ))
+            self.ordered = True
+            self.payment = payment
+            self.save(update_fields=['ordered', 'payment'])
+
+    class Meta:
+        # back the admin's list filters
+        indexes = [
+            models.Index(fields=['ordered', 'ordered_date']),
+            models.Index(fields=['being_delivered', 'received']),
+        ]
+
 
 
 class Payment(models.Model):
-    stripe_charge_id = models.CharField(max_length=50)
+    stripe_charge_id = models.CharField(max_length=50, db_index=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
     amount = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return self.user.username
 
 
+class PaymentAttempt(models.Model):
+    # one row per idempotency key, see imageapp/payments.py
+    PENDING = 'P'
+    SUCCEEDED = 'S'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    charge_id = models.CharField(max_length=50, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+
 class Coupon(models.Model):
-    code = models.CharField(max_length=15)
+    code = models.CharField(max_length=15, unique=True)
     amount = models.FloatField()
+    valid_from = models.DateTimeField(blank=True, null=True)
+    valid_until = models.DateTimeField(blank=True, null=True)
+    max_uses = models.PositiveIntegerField(blank=True, null=True)
+    times_used = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.code
 
+    def is_valid(self, now=None):
+        # a quick check for display, coupons.redeem() is authoritative
+        now = now or timezone.now()
+        if self.valid_from and now < self.valid_from:
+            return False
+        if self.valid_until and now >= self.valid_until:
+            return False
+        return self.max_uses is None or self.times_used < self.max_uses
+
+
+class PhotoSalesDaily(models.Model):
+    # kept up to date by imageapp.sales.record_order, revenue is before coupons
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.photo_id} on {self.date}"
+
+    class Meta:
+        verbose_name_plural = 'Photo sales daily'
+        constraints = [
+            models.UniqueConstraint(fields=['photo', 'date'], name='unique_photo_sales_day'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'date']),
+        ]
+
+
+class UserSalesDaily(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} on {self.date}"
+
+    class Meta:
+        verbose_name_plural = 'User sales daily'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_user_sales_day'),
+        ]
+
+
+class PhotoPopularity(models.Model):
+    # hourly counters, flushed in batches by imageapp.popularity
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE)
+    bucket = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    carts = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.photo_id} at {self.bucket}"
+
+    class Meta:
+        verbose_name_plural = 'Photo popularity'
+        constraints = [
+            models.UniqueConstraint(fields=['photo', 'bucket'], name='unique_photo_popularity_bucket'),
+        ]
+
+
+class PhotoTrending(models.Model):
+    # log of the time-decayed popularity, see imageapp.popularity
+    photo = models.OneToOneField(Photo, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField(db_index=True)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.photo_id}: {self.score}"
+
+    class Meta:
+        verbose_name_plural = 'Photo trending'
+
 
 class Address(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
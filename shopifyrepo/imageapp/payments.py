@@ -0,0 +1,128 @@
+"""
+Payment provider client and idempotent charge bookkeeping.
+
+Every payment form carries an idempotency key. The first POST with a key
+claims a PaymentAttempt row; any duplicate of it (double click, browser
+retry) finds that row and replays its stored outcome instead of calling
+the provider again. The key is also forwarded to Stripe, so a request that
+does reach it twice is still only charged once.
+"""
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import PaymentAttempt
+
+
+logger = logging.getLogger(__name__)
+
+_configured = False
+
+
+def get_stripe():
+    # stripe pulls in requests and all of its API resources (over 100ms),
+    # so it's imported on the first payment request rather than at boot
+    import stripe
+    global _configured
+    if not _configured:
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        if settings.STRIPE_API_BASE:
+            # e.g. the local server started by `manage.py fake_stripe`
+            stripe.api_base = settings.STRIPE_API_BASE
+        _configured = True
+    return stripe
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def fingerprint(user, *values):
+    data = '\0'.join(str(value) for value in (user.pk,) + values)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class PendingPayment:
+    """What PaymentView carries from claiming an attempt to charging for it."""
+
+    def __init__(self, key, token, save, use_default, attempt, order, userprofile, line_prices):
+        self.key = key
+        self.token = token
+        self.save = save
+        self.use_default = use_default
+        self.attempt = attempt
+        self.order = order
+        self.userprofile = userprofile
+        self.line_prices = line_prices
+        self.total = order.get_total(line_prices)
+        self.amount = int(round(self.total * 100))  # cents
+        self.charge = None
+
+
+def error_message(error):
+    """The message shown to the customer for an exception raised while paying."""
+    stripe = get_stripe()
+    if isinstance(error, stripe.error.CardError):
+        return f"{error.json_body.get('error', {}).get('message')}"
+    if isinstance(error, stripe.error.RateLimitError):
+        # Too many requests made to the API too quickly
+        return "Rate limit error"
+    if isinstance(error, stripe.error.InvalidRequestError):
+        # Invalid parameters were supplied to Stripe's API
+        logger.exception("Invalid parameters sent to Stripe")
+        return "Invalid parameters"
+    if isinstance(error, stripe.error.AuthenticationError):
+        # Authentication with Stripe's API failed
+        # (maybe you changed API keys recently)
+        return "Not authenticated"
+    if isinstance(error, stripe.error.APIConnectionError):
+        # Network communication with Stripe failed
+        return "Network error"
+    if isinstance(error, stripe.error.StripeError):
+        # Display a very generic error to the user, and maybe send
+        # yourself an email
+        return "Something went wrong. You were not charged. Please try again."
+    # send an email to ourselves
+    return "A serious error occurred. We have been notifed."
+
+
+def get_attempt(user, key):
+    return PaymentAttempt.objects.filter(user=user, key=key).first()
+
+
+def claim_attempt(key, user, order, request_fingerprint):
+    """
+    Return ``(attempt, created)``. ``created`` is False when a concurrent
+    duplicate claimed the key first.
+    """
+    try:
+        with transaction.atomic():
+            attempt = PaymentAttempt.objects.create(
+                key=key,
+                user=user,
+                order=order,
+                fingerprint=request_fingerprint
+            )
+        return attempt, True
+    except IntegrityError:
+        return PaymentAttempt.objects.get(key=key), False
+
+
+def fail_attempt(attempt, message, charge=None):
+    attempt.message = message[:255]
+    if charge is None:
+        attempt.status = PaymentAttempt.FAILED
+    else:
+        # the customer was charged but we failed afterwards, keep it
+        # pending so it's replayed as in progress and can be reconciled
+        attempt.charge_id = charge['id']
+    attempt.save(update_fields=['status', 'message', 'charge_id', 'updated'])
+
+
+def succeed_attempt(attempt, charge):
+    attempt.status = PaymentAttempt.SUCCEEDED
+    attempt.charge_id = charge['id']
+    attempt.save(update_fields=['status', 'charge_id', 'updated'])
@@ -0,0 +1,189 @@
+"""
+Photo popularity counters and the trending feed.
+
+Views and add-to-carts are only counted in memory; every
+POPULARITY_FLUSH_INTERVAL seconds the request that notices it flushes the
+worker's counts to the hourly PhotoPopularity rows in a couple of batched
+UPDATEs, and folds them into each photo's trending score.
+
+The score is the log of an exponentially decayed sum of the weighted
+events. Rather than decaying every score as time passes, new events are
+weighted up by ``exp((t - EPOCH) / tau)``, which ranks photos the same way,
+so a flush only touches the photos that had events. The logs keep the
+growing weights in float range. The top of the ranking is cached.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from . import metrics
+from .models import Photo, PhotoPopularity, PhotoTrending
+from .sales import increment
+
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('views', 'carts')
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+CACHE_KEY = 'trending:photos'
+
+_pending = defaultdict(lambda: dict.fromkeys(EVENTS, 0))
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def record(photo_id, event):
+    """Count a ``'views'`` or ``'carts'`` event, flushing if one is due."""
+    global _last_flush
+    with _lock:
+        _pending[photo_id][event] += 1
+        due = time.monotonic() - _last_flush >= settings.POPULARITY_FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        # the request that happens to flush mustn't fail because of it
+        try_flush()
+
+
+def log_weight(counts, when):
+    """The log of the decayed weight that ``counts`` seen at ``when`` add to a score."""
+    weight = sum(settings.POPULARITY_WEIGHTS[event] * counts[event] for event in EVENTS)
+    if weight <= 0:
+        return None
+    tau = settings.TRENDING_HALF_LIFE / math.log(2)
+    return math.log(weight) + (when - EPOCH).total_seconds() / tau
+
+
+def log_add(a, b):
+    """log(exp(a) + exp(b)) without overflowing."""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def flush():
+    """
+    Write this worker's pending counts to the database. If that fails they
+    are pending again, so the next flush retries them.
+    """
+    global _pending
+    with _lock:
+        pending, _pending = _pending, defaultdict(lambda: dict.fromkeys(EVENTS, 0))
+    if not pending:
+        return
+    try:
+        written = write(pending)
+    except Exception:
+        with _lock:
+            for pk, counts in pending.items():
+                for event, count in counts.items():
+                    _pending[pk][event] += count
+        raise
+    if written:
+        metrics.incr('popularity.flushes')
+        metrics.incr('popularity.events', sum(sum(counts.values()) for counts in written.values()))
+        refresh_trending()
+
+
+def write(pending):
+    """Add ``pending`` to the counters and scores in one transaction; returns what was written."""
+    # photos deleted since they were counted
+    pending = {
+        pk: pending[pk]
+        for pk in Photo.objects.filter(pk__in=list(pending)).values_list('pk', flat=True)
+    }
+    if not pending:
+        return
+
+    now = timezone.now()
+    bucket = now.replace(minute=0, second=0, microsecond=0)
+    with transaction.atomic():
+        # the INSERT comes first, so on SQLite the transaction holds the
+        # write lock before it reads the scores and can't fail upgrading to it
+        PhotoPopularity.objects.bulk_create([
+            PhotoPopularity(photo_id=pk, bucket=bucket) for pk in pending
+        ], ignore_conflicts=True)
+        increment(PhotoPopularity, {'bucket': bucket}, 'photo_id', pending)
+
+        scores = dict(PhotoTrending.objects.filter(
+            photo_id__in=list(pending)).values_list('photo_id', 'score'))
+        updated = {}
+        for pk, counts in pending.items():
+            weight = log_weight(counts, now)
+            if weight is not None:
+                updated[pk] = log_add(scores.get(pk), weight)
+        save_scores(updated, scores, now)
+    return pending
+
+
+def save_scores(updated, existing, now):
+    PhotoTrending.objects.bulk_create([
+        PhotoTrending(photo_id=pk, score=score, updated_at=now)
+        for pk, score in updated.items() if pk not in existing
+    ])
+    changed = {pk: score for pk, score in updated.items() if pk in existing}
+    if changed:
+        PhotoTrending.objects.filter(photo_id__in=list(changed)).update(
+            score=Case(
+                *[When(photo_id=pk, then=Value(score)) for pk, score in changed.items()],
+                output_field=PhotoTrending._meta.get_field('score'),
+            ),
+            updated_at=now,
+        )
+
+
+def try_flush():
+    try:
+        flush()
+    except Exception:
+        metrics.incr('popularity.flush_errors')
+        logger.exception("Could not flush popularity counters")
+
+
+atexit.register(try_flush)
+
+
+def refresh_trending():
+    """Recompute the cached top of the trending ranking."""
+    photos = list(
+        Photo.objects.filter(trending__isnull=False)
+        .order_by('-trending__score')[:settings.TRENDING_SIZE]
+    )
+    cache.set(CACHE_KEY, photos, settings.TRENDING_CACHE_TTL)
+    return photos
+
+
+def trending():
+    """The most popular photos lately, from the cache when possible."""
+    photos = cache.get(CACHE_KEY)
+    if photos is None:
+        photos = refresh_trending()
+    return photos
+
+
+def rebuild():
+    """Recompute all trending scores from all of the hourly counters."""
+    buckets = PhotoPopularity.objects.all()
+    scores = {}
+    for photo_id, when, views, carts in buckets.values_list('photo_id', 'bucket', 'views', 'carts').iterator():
+        weight = log_weight({'views': views, 'carts': carts}, when)
+        if weight is not None:
+            scores[photo_id] = log_add(scores.get(photo_id), weight)
+
+    now = timezone.now()
+    with transaction.atomic():
+        PhotoTrending.objects.all().delete()
+        save_scores(scores, {}, now)
+    refresh_trending()
+    return len(scores)
@@ -0,0 +1,168 @@
+"""
+Token bucket rate limiting for the expensive write paths.
+
+A rule like ``'30/m'`` is a bucket of 30 tokens per client that refills at
+30 tokens a minute; every limited request takes one, and a request finding
+the bucket empty gets a 429 before its view runs. Clients are the logged-in
+user, or the IP address for anonymous visitors.
+
+RateLimitMiddleware applies the RATELIMITS setting, keyed by URL name; the
+``ratelimit`` decorator limits a single view. Buckets live in
+RATELIMIT_STORE: ``memory`` keeps them per process, ``sqlite`` shares them
+between the workers of a host through a small SQLite file (one UPSERT per
+check).
+"""
+import functools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """``'30/m'`` -> (capacity 30, refill 0.5 tokens per second)."""
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+class MemoryStore:
+    """Buckets of this process only; the least recently used are dropped past ``maxsize``."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, now):
+        """Take a token, returning 0 or the seconds until one is available."""
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            wait = 0 if tokens >= 1 else (1 - tokens) / refill
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteStore:
+    """Buckets shared by all processes using the same SQLite file."""
+
+    TAKE = """
+        INSERT INTO bucket (key, tokens, updated) VALUES (:key, :capacity - 1, :now)
+        ON CONFLICT (key) DO UPDATE
+        SET tokens = min(:capacity, tokens + (:now - updated) * :refill) - 1, updated = :now
+        WHERE min(:capacity, tokens + (:now - updated) * :refill) >= 1
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # losing a few buckets in a crash is fine
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, capacity, refill, now):
+        params = {'key': key, 'capacity': capacity, 'refill': refill, 'now': now}
+        if self.connection.execute(self.TAKE, params).rowcount:
+            return 0
+        row = self.connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * refill) if row else capacity
+        return max(0, (1 - tokens) / refill)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM bucket')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.RATELIMIT_STORE == 'sqlite':
+                    _store = SQLiteStore(settings.RATELIMIT_SQLITE_PATH)
+                else:
+                    _store = MemoryStore()
+    return _store
+
+
+def client_key(request):
+    # the user id is read from the session, the user itself isn't loaded
+    user_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def check(request, name, rate):
+    """A 429 response if the client used up its ``rate`` for ``name``, else None."""
+    capacity, refill = parse_rate(rate)
+    wait = get_store().take(f"{name}:{client_key(request)}", capacity, refill, time.time())
+    if not wait:
+        return None
+    metrics.incr(f"ratelimit.{name}.limited")
+    response = HttpResponse("Too many requests, please try again later.", status=429,
+                            content_type='text/plain')
+    response['Retry-After'] = str(int(wait) + 1)
+    return response
+
+
+def ratelimit(rate, methods=('POST',), name=None):
+    """Limit a view to ``rate`` requests per client for ``methods``."""
+    def decorator(view):
+        key = name or f"{view.__module__}.{view.__qualname__}"
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if settings.RATELIMIT_ENABLED and request.method in methods:
+                response = check(request, key, rate)
+                if response is not None:
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """Applies the RATELIMITS setting: ``{url name: (rate, methods)}``."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.RATELIMIT_ENABLED or request.resolver_match is None:
+            return None
+        rule = settings.RATELIMITS.get(request.resolver_match.view_name)
+        if rule is None:
+            return None
+        rate, methods = rule
+        if request.method not in methods:
+            return None
+        return check(request, request.resolver_match.view_name, rate)
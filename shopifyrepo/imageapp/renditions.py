@@ -0,0 +1,197 @@
+"""
+On-demand photo renditions.
+
+A rendition is ``Photo.image`` cropped to ``Photo.cropping`` and resized to
+an arbitrary ``width x height`` in one of the supported formats. Rendition
+URLs carry an HMAC signature so only sizes generated by the app itself can
+be requested, and rendered files live in a size-bounded on-disk LRU cache
+under ``RENDITION_CACHE_DIR``. Concurrent requests for the same variant,
+from any worker, are collapsed into a single render.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from PIL import Image, ImageOps
+
+from .locks import single_flight
+
+
+FORMATS = {
+    # name: (PIL format, content type, file extension)
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+}
+
+# only bump the mtime of a cache hit once per this many seconds
+TOUCH_INTERVAL = 60
+
+_cache_bytes = None
+_cache_bytes_lock = threading.Lock()
+
+
+def sign(pk, width, height, fmt):
+    value = f"{pk}:{width}x{height}:{fmt}"
+    return salted_hmac('imageapp.renditions', value).hexdigest()[:20]
+
+
+def is_valid_request(pk, width, height, fmt, signature):
+    if fmt not in FORMATS:
+        return False
+    max_width, max_height = settings.RENDITION_MAX_SIZE
+    if not (0 < width <= max_width and 0 < height <= max_height):
+        return False
+    return constant_time_compare(sign(pk, width, height, fmt), signature)
+
+
+def rendition_url(pk, width, height, fmt='jpeg'):
+    return reverse("imageapp:photo-rendition", kwargs={
+        'pk': pk,
+        'width': width,
+        'height': height,
+        'fmt': fmt,
+        'signature': sign(pk, width, height, fmt),
+    })
+
+
+def content_type(fmt):
+    return FORMATS[fmt][1]
+
+
+def source_digest(image_name, cropping):
+    return salted_hmac(
+        'imageapp.renditions.source', f"{image_name}:{cropping}"
+    ).hexdigest()[:12]
+
+
+def rendition_dir(pk):
+    return os.path.join(settings.RENDITION_CACHE_DIR, str(pk))
+
+
+def cache_path(photo, width, height, fmt):
+    # the source name and crop box are part of the file name so replacing
+    # the image or changing the crop never serves a stale rendition
+    source = source_digest(photo.image.name, photo.cropping)
+    name = f"{width}x{height}-{source}.{FORMATS[fmt][2]}"
+    return os.path.join(rendition_dir(photo.pk), name)
+
+
+def get_rendition(photo, width, height, fmt):
+    """
+    Return the path of a cached rendition, rendering it if needed, or None
+    if another worker is still rendering it after SINGLE_FLIGHT_WAIT.
+    """
+    path = cache_path(photo, width, height, fmt)
+
+    def lookup():
+        return path if _touch(path) else None
+
+    def produce():
+        _render(photo, width, height, fmt, path)
+        return path
+
+    return single_flight('rendition', path, lookup, produce)
+
+
+def _touch(path):
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+    now = time.time()
+    if now - mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            # evicted between the stat and the touch
+            return False
+    return True
+
+
+def crop_box(photo):
+    try:
+        box = tuple(int(v) for v in photo.cropping.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+
+def _render(photo, width, height, fmt, path):
+    pil_format = FORMATS[fmt][0]
+    with photo.image.open('rb') as source:
+        with Image.open(source) as image:
+            box = crop_box(photo)
+            if box:
+                image = image.crop(box)
+            if pil_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    image.save(tmp, pil_format, quality=settings.RENDITION_QUALITY)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    _account(os.path.getsize(path))
+
+
+def _scan_cache():
+    entries = []
+    for root, dirs, files in os.walk(settings.RENDITION_CACHE_DIR):
+        for name in files:
+            if name.endswith('.tmp'):
+                # still being written by some worker
+                continue
+            full_path = os.path.join(root, name)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, full_path))
+    return entries
+
+
+def _account(size):
+    global _cache_bytes
+    with _cache_bytes_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry[1] for entry in _scan_cache())
+        else:
+            _cache_bytes += size
+        if _cache_bytes > settings.RENDITION_CACHE_MAX_BYTES:
+            _cache_bytes = evict()
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used renditions until the cache is below 90% of
+    ``max_bytes``. Other workers share the directory, so the size is always
+    recomputed from disk here. Returns the resulting cache size.
+    """
+    if max_bytes is None:
+        max_bytes = settings.RENDITION_CACHE_MAX_BYTES
+    entries = sorted(_scan_cache())
+    total = sum(entry[1] for entry in entries)
+    target = max_bytes * 0.9
+    for mtime, size, full_path in entries:
+        if total <= target:
+            break
+        try:
+            os.unlink(full_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
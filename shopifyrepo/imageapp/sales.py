@@ -0,0 +1,120 @@
+"""
+Per-photo and per-seller daily sales aggregates.
+
+``record_order`` adds a freshly paid order to the aggregate tables in a
+fixed number of statements, so the dashboard never has to scan orders;
+``manage.py rebuild_sales_stats`` recomputes them from the order history.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import models
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import OrderPhoto, PhotoSalesDaily, UserSalesDaily, current_photo_price
+
+
+def increment(model, filters, key_field, deltas):
+    """
+    Add ``deltas`` (``{key: {field: amount}}``) to the rows matching
+    ``filters`` in one UPDATE, using a CASE on ``key_field`` per column.
+    """
+    fields = {field for amounts in deltas.values() for field in amounts}
+    model.objects.filter(**filters, **{f"{key_field}__in": list(deltas)}).update(**{
+        field: F(field) + Case(
+            *[When(**{key_field: key}, then=Value(amounts[field])) for key, amounts in deltas.items()],
+            default=Value(0),
+            output_field=model._meta.get_field(field),
+        )
+        for field in fields
+    })
+
+
+def record_order(order, date=None):
+    """Add a finalized order to the daily aggregates; call it in the payment transaction."""
+    date = date or timezone.localdate()
+    lines = order.photos.values_list('photo_id', 'photo__user_id', 'unit_price', 'quantity')
+
+    photos = defaultdict(lambda: {'units': 0, 'revenue': 0.0})
+    sellers = defaultdict(lambda: {'orders': 1, 'units': 0, 'revenue': 0.0})
+    photo_sellers = {}
+    for photo_id, seller_id, unit_price, quantity in lines:
+        revenue = (unit_price or 0) * quantity
+        photos[photo_id]['units'] += quantity
+        photos[photo_id]['revenue'] += revenue
+        sellers[seller_id]['units'] += quantity
+        sellers[seller_id]['revenue'] += revenue
+        photo_sellers[photo_id] = seller_id
+    if not photos:
+        return
+
+    # make sure today's rows exist, then bump them all at once
+    PhotoSalesDaily.objects.bulk_create([
+        PhotoSalesDaily(photo_id=photo_id, seller_id=photo_sellers[photo_id], date=date)
+        for photo_id in photos
+    ], ignore_conflicts=True)
+    UserSalesDaily.objects.bulk_create([
+        UserSalesDaily(user_id=seller_id, date=date) for seller_id in sellers
+    ], ignore_conflicts=True)
+    increment(PhotoSalesDaily, {'date': date}, 'photo_id', photos)
+    increment(UserSalesDaily, {'date': date}, 'user_id', sellers)
+
+
+def rebuild(since=None, batch_size=1000):
+    """Recompute the aggregates from paid orders, optionally only from ``since`` on."""
+    photo_rows = PhotoSalesDaily.objects.all()
+    user_rows = UserSalesDaily.objects.all()
+    lines = OrderPhoto.objects.filter(ordered=True, order__payment__isnull=False)
+    if since is not None:
+        photo_rows = photo_rows.filter(date__gte=since)
+        user_rows = user_rows.filter(date__gte=since)
+        lines = lines.filter(order__payment__timestamp__date__gte=since)
+    photo_rows.delete()
+    user_rows.delete()
+
+    lines = lines.annotate(
+        day=TruncDate('order__payment__timestamp'),
+        line_revenue=F('quantity') * Coalesce('unit_price', current_photo_price()),
+    )
+    by_photo = lines.values('photo_id', 'photo__user_id', 'day').annotate(
+        total_units=Sum('quantity'),
+        total_revenue=Sum('line_revenue', output_field=models.FloatField()),
+    ).order_by()
+    by_seller = lines.values('photo__user_id', 'day').annotate(
+        total_orders=Count('order', distinct=True),
+        total_units=Sum('quantity'),
+        total_revenue=Sum('line_revenue', output_field=models.FloatField()),
+    ).order_by()
+
+    PhotoSalesDaily.objects.bulk_create((
+        PhotoSalesDaily(photo_id=row['photo_id'], seller_id=row['photo__user_id'], date=row['day'],
+                        units=row['total_units'], revenue=row['total_revenue'] or 0)
+        for row in by_photo.iterator()
+    ), batch_size=batch_size)
+    UserSalesDaily.objects.bulk_create((
+        UserSalesDaily(user_id=row['photo__user_id'], date=row['day'], orders=row['total_orders'],
+                       units=row['total_units'], revenue=row['total_revenue'] or 0)
+        for row in by_seller.iterator()
+    ), batch_size=batch_size)
+
+
+def dashboard(user, days=30, top=10):
+    """Sales of ``user``'s photos over the last ``days`` days, from the aggregates only."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    daily = list(UserSalesDaily.objects.filter(user=user, date__gte=since).order_by('-date'))
+    top_photos = PhotoSalesDaily.objects.filter(seller=user, date__gte=since).values(
+        'photo_id', 'photo__description', 'photo__slug',
+    ).annotate(
+        total_units=Sum('units'),
+        total_revenue=Sum('revenue'),
+    ).order_by('-total_revenue')[:top]
+    return {
+        'days': days,
+        'daily': daily,
+        'top_photos': list(top_photos),
+        'total_orders': sum(day.orders for day in daily),
+        'total_units': sum(day.units for day in daily),
+        'total_revenue': sum(day.revenue for day in daily),
+    }
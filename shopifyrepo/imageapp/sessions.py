@@ -0,0 +1,38 @@
+"""
+Session middleware that skips writing sessions which didn't really change.
+
+Django saves a session whenever it was assigned to, even if the value put
+back is the one it already held. Here the loaded data (and key) are
+remembered, and the save is dropped when both still match at the end of
+the request. It works with any SESSION_ENGINE.
+"""
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+
+class SkipUnchangedSessionMixin:
+    _loaded = None
+
+    def load(self):
+        data = super().load()
+        self._loaded = (self._session_key, self.serializer().dumps(data))
+        return data
+
+    def has_changed(self):
+        if not self.modified:
+            return False
+        if self._loaded is None:
+            # assigned to without being read first
+            return True
+        return self._loaded != (self._session_key, self.serializer().dumps(self._session))
+
+
+class SessionMiddleware(BaseSessionMiddleware):
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.SessionStore = type('SessionStore', (SkipUnchangedSessionMixin, self.SessionStore), {})
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and session.modified and not session.has_changed():
+            session.modified = False
+        return super().process_response(request, response)
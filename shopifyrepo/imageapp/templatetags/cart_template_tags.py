@@ -1,13 +1,17 @@
 from django import template
+from imageapp.cart import get_cart
 from imageapp.models import Order
+from imageapp.templating import timed
 
 register = template.Library()
 
 
 @register.filter
-def cart_item_count(user):
-    if user.is_authenticated:
-        qs = Order.objects.filter(user=user, ordered=False)
+@timed
+def cart_item_count(request):
+    if request.user.is_authenticated:
+        qs = Order.objects.filter(user=request.user, ordered=False)
         if qs.exists():
             return qs[0].photos.count()
-    return 0
+        return 0
+    return len(get_cart(request))
@@ -0,0 +1,52 @@
+from django import template
+from django.conf import settings
+from easy_thumbnails.exceptions import InvalidImageFormatError
+from easy_thumbnails.files import get_thumbnailer
+from imageapp.locks import single_flight
+from imageapp.templating import timed
+
+register = template.Library()
+
+
+@register.simple_tag
+@timed
+def rendition(photo, width, height, fmt='jpeg'):
+    return photo.get_rendition_url(width, height, fmt)
+
+
+@register.simple_tag
+@timed
+def photo_thumbnail(photo, scale=1):
+    """
+    Cropped thumbnail of ``photo`` like image_cropping's ``cropped_thumbnail``,
+    but only one worker generates a missing thumbnail while the others wait
+    for it, falling back to the original image if it takes too long.
+    """
+    if not photo.image:
+        return ''
+    ratiofield = photo._meta.get_field('cropping')
+    options = {
+        'size': (int(int(ratiofield.width) * scale), int(int(ratiofield.height) * scale)),
+        'box': photo.cropping,
+        'crop': True,
+        'detail': True,
+        'upscale': False,
+    }
+    thumbnailer = get_thumbnailer(photo.image)
+
+    def lookup():
+        return thumbnailer.get_existing_thumbnail(options)
+
+    def produce():
+        return thumbnailer.get_thumbnail(options)
+
+    key = f"{photo.pk}:{thumbnailer.get_thumbnail_name(options)}"
+    try:
+        thumbnail = single_flight('thumbnail', key, lookup, produce)
+    except InvalidImageFormatError:
+        if getattr(settings, 'THUMBNAIL_DEBUG', False):
+            raise
+        return ''
+    if thumbnail is None:
+        return photo.image.url
+    return thumbnail.url
@@ -0,0 +1,141 @@
+"""
+Template compilation and render timing.
+
+With TEMPLATE_CACHE on, templates are parsed once per worker by Django's
+cached loader; ``warm()`` does that for all of the shop's templates when
+the WSGI/ASGI application loads, so the first visitors don't pay for it.
+With TEMPLATE_TIMING on, the TimedDjangoTemplates backend and the tags
+decorated with ``timed`` send ``render_timed``, which adds the time spent
+per template and per tag to the metrics.
+"""
+import functools
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.dispatch import Signal
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.loader_tags import ExtendsNode, IncludeNode
+from django.template.loaders.cached import Loader as CachedLoader
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# sent with kind ('template' or 'tag'), name and seconds
+render_timed = Signal()
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            render_timed.send(sender=self.__class__, kind='template', name=self.template.name,
+                              seconds=time.perf_counter() - start)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates whose templates report how long rendering them took."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def timed(func):
+    """Report the time spent in a template tag or filter."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            render_timed.send(sender=func, kind='tag', name=func.__name__,
+                              seconds=time.perf_counter() - start)
+    return wrapper
+
+
+def metrics_receiver(sender, kind, name, seconds, **kwargs):
+    metrics.incr(f"{kind}.{name}.renders")
+    metrics.incr(f"{kind}.{name}.us", int(seconds * 1000000))
+
+
+def get_engine():
+    return next(backend.engine for backend in engines.all() if isinstance(backend, DjangoTemplates))
+
+
+def is_cached(engine=None):
+    engine = engine or get_engine()
+    return any(isinstance(loader, CachedLoader) for loader in engine.template_loaders)
+
+
+def template_names():
+    """Names of the templates in the project's and imageapp's template dirs."""
+    directories = [Path(directory) for directory in get_engine().dirs]
+    directories.append(Path(apps.get_app_config('imageapp').path) / 'templates')
+    names = set()
+    for directory in directories:
+        if not directory.is_dir():
+            continue
+        for path in directory.rglob('*'):
+            if path.is_file() and path.suffix in ('.html', '.txt'):
+                names.add(path.relative_to(directory).as_posix())
+    return sorted(names)
+
+
+def referenced_names(template):
+    """Templates a compiled template extends or includes by a literal name."""
+    names = []
+    for node in template.nodelist.get_nodes_by_type(ExtendsNode):
+        if isinstance(node.parent_name.var, str):
+            names.append(node.parent_name.var)
+    for node in template.nodelist.get_nodes_by_type(IncludeNode):
+        if isinstance(node.template.var, str):
+            names.append(node.template.var)
+    return names
+
+
+def compile_templates(names=None):
+    """
+    Load (and so parse) ``names``, all of the shop's templates by default,
+    and check that the templates they extend or include exist. Returns
+    ``({name: seconds}, {name: error})``; with the cached loader the
+    templates stay compiled.
+    """
+    engine = get_engine()
+    timings, errors = {}, {}
+    for name in names or template_names():
+        start = time.perf_counter()
+        try:
+            template = engine.get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+            continue
+        timings[name] = time.perf_counter() - start
+        for reference in referenced_names(template):
+            try:
+                engine.get_template(reference)
+            except TemplateDoesNotExist:
+                errors[name] = f"uses missing template {reference!r}"
+            except TemplateSyntaxError as e:
+                errors[name] = f"uses broken template {reference!r}: {e}"
+    return timings, errors
+
+
+def warm():
+    """Compile all templates into the cached loader, if there is one."""
+    if not is_cached():
+        return
+    timings, errors = compile_templates()
+    for name, error in errors.items():
+        logger.warning("Template %s: %s", name, error)
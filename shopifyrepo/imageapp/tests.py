@@ -1,3 +1,826 @@
-from django.test import TestCase
+import fcntl
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core import signing
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import coupons, locks, metrics, payments, popularity, ratelimit, renditions
+from .cache import TwoTierCache, key_prefix
+from .cart import COOKIE_SALT, CookieCart, merge_cart, merge_cart_receiver
+from .management.commands.fake_stripe import DECLINED_TOKEN, FakeStripe, make_handler
+from .models import (
+    Address, Coupon, Order, OrderPhoto, Payment, PaymentAttempt, Photo, PhotoPopularity, PhotoTrending,
+    UserProfile,
+)
+
+
+def make_photo(user, slug, price=10):
+    data = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(data, 'PNG')
+    return Photo.objects.create(user=user, description=slug, slug=slug, price=price,
+                                image=SimpleUploadedFile(f"{slug}.png", data.getvalue()))
+
+
+class MediaTestCase(TestCase):
+    """Keeps the photos a test uploads out of the real media directory."""
+
+    def setUp(self):
+        self.media_root = media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(
+            MEDIA_ROOT=media_root,
+            RENDITION_CACHE_DIR=os.path.join(media_root, 'renditions'),
+            SINGLE_FLIGHT_LOCK_DIR=os.path.join(media_root, '.locks'),
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class CookieCartTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='buyer')
+        self.photo = make_photo(self.user, 'lake')
+
+    def cart_with_cookie(self, value):
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.CART_COOKIE_NAME] = value
+        return CookieCart(request)
+
+    def signed(self, items):
+        return signing.dumps(items, salt=COOKIE_SALT, compress=True)
+
+    def test_round_trip(self):
+        cart = self.cart_with_cookie('')
+        cart.add(self.photo)
+        cart.add(self.photo)
+        response = HttpResponse()
+        cart.update_response(response)
+
+        cart = self.cart_with_cookie(response.cookies[settings.CART_COOKIE_NAME].value)
+        self.assertEqual(cart.items, {str(self.photo.pk): 2})
+
+    def test_tampered_cookie_is_an_empty_cart(self):
+        value = self.signed({str(self.photo.pk): 1})
+        signature = value.rsplit(':', 1)[1]
+        tampered = self.signed({str(self.photo.pk): 50}).rsplit(':', 1)[0] + ':' + signature
+        self.assertEqual(self.cart_with_cookie(tampered).items, {})
+        self.assertEqual(self.cart_with_cookie(value[:-1]).items, {})
+
+    def test_cookie_signed_with_another_salt_is_an_empty_cart(self):
+        value = signing.dumps({str(self.photo.pk): 1}, salt='something else', compress=True)
+        self.assertEqual(self.cart_with_cookie(value).items, {})
+
+    def test_signed_non_dict_is_an_empty_cart(self):
+        self.assertEqual(self.cart_with_cookie(self.signed([1, 2])).items, {})
+
+    def test_merge_adds_to_the_open_order(self):
+        other = make_photo(self.user, 'forest')
+        order = Order.objects.create(user=self.user, ordered_date=self.photo.created_at)
+        existing = OrderPhoto.objects.create(user=self.user, photo=self.photo, quantity=2)
+        order.photos.add(existing)
+
+        cart = self.cart_with_cookie(self.signed({str(self.photo.pk): 1, str(other.pk): 3, '999999': 1}))
+        merge_cart(cart, self.user)
+
+        quantities = dict(order.photos.values_list('photo_id', 'quantity'))
+        self.assertEqual(quantities, {self.photo.pk: 3, other.pk: 3})
+        self.assertEqual(Order.objects.filter(user=self.user, ordered=False).count(), 1)
+        self.assertEqual(cart.items, {})
+
+    def test_merge_ignores_lines_left_outside_the_order(self):
+        other = make_photo(self.user, 'forest')
+        order = Order.objects.create(user=self.user, ordered_date=self.photo.created_at)
+        order.photos.add(OrderPhoto.objects.create(user=self.user, photo=self.photo, quantity=2))
+        # what removing the last unit of a photo from the cart leaves behind
+        OrderPhoto.objects.create(user=self.user, photo=self.photo, quantity=7)
+        OrderPhoto.objects.create(user=self.user, photo=other, quantity=5)
+
+        merge_cart(self.cart_with_cookie(self.signed({str(self.photo.pk): 1, str(other.pk): 1})), self.user)
+
+        self.assertCountEqual(order.photos.values_list('photo_id', 'quantity'),
+                              [(self.photo.pk, 3), (other.pk, 1)])
+        leftovers = OrderPhoto.objects.filter(order=None).values_list('photo_id', 'quantity')
+        self.assertEqual(list(leftovers), [(self.photo.pk, 7)])
+
+    def test_failed_merge_keeps_the_cookie_cart(self):
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.CART_COOKIE_NAME] = self.signed({str(self.photo.pk): 1})
+        with mock.patch('imageapp.cart.increment', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('imageapp.cart', 'ERROR'):
+            merge_cart_receiver(sender=User, request=request, user=self.user)
+        self.assertEqual(request._cookie_cart.items, {str(self.photo.pk): 1})
+        self.assertFalse(OrderPhoto.objects.filter(user=self.user).exists())
+
+
+class CheckoutTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='buyer')
+        self.client.force_login(self.user)
+        self.order = Order.objects.create(user=self.user, ordered_date=timezone.now())
+        self.data = {
+            'shipping_address': '1 Main St', 'shipping_country': 'CA', 'shipping_zip': 'K1A0B1',
+            'same_billing_address': 'on', 'payment_option': 'S',
+        }
+
+    def test_addresses_are_saved_on_the_order(self):
+        response = self.client.post(reverse('imageapp:checkout'), self.data)
+        self.assertRedirects(response, reverse('imageapp:payment', args=['stripe']),
+                             fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.shipping_address.street_address, '1 Main St')
+        self.assertEqual(self.order.billing_address.address_type, 'B')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_only_the_country_selects_are_cached_per_release(self):
+        cache.clear()
+        Address.objects.create(user=self.user, street_address='42 Elm Road', country='CA', zip='K1A0B1',
+                               address_type='S', default=True)
+        with override_settings(TEMPLATE_CACHE_VERSION='r1'):
+            response = self.client.get(reverse('imageapp:checkout'))
+        self.assertContains(response, 'Use default shipping address: 42 Elm Ro')
+        key = make_template_fragment_key('checkout_country_select', ['shipping', settings.LANGUAGE_CODE, 'r1'])
+        self.assertIn('name="shipping_country"', cache.get(key))
+        self.assertNotIn('42 Elm', cache.get(key))
+
+        cache.set(key, 'stale')
+        with override_settings(TEMPLATE_CACHE_VERSION='r2'):
+            response = self.client.get(reverse('imageapp:checkout'))
+        self.assertNotContains(response, 'stale')
+        self.assertContains(response, 'name="shipping_country"')
+
+    def test_no_open_order(self):
+        Order.objects.filter(pk=self.order.pk).update(ordered=True)
+        response = self.client.post(reverse('imageapp:checkout'), self.data)
+        self.assertRedirects(response, reverse('imageapp:order-summary'), fetch_redirect_response=False)
+        self.assertFalse(Address.objects.exists())
+
+
+class CouponTests(TestCase):
+    def setUp(self):
+        coupons._cache.clear()
+        self.coupon = Coupon.objects.create(code='SPRING', amount=5, max_uses=2)
+
+    def test_redeem_stops_at_the_limit(self):
+        self.assertTrue(coupons.redeem(self.coupon.pk))
+        self.assertTrue(coupons.redeem(self.coupon.pk))
+        self.assertFalse(coupons.redeem(self.coupon.pk))
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 2)
+
+    def test_release_frees_a_use(self):
+        coupons.redeem(self.coupon.pk)
+        coupons.redeem(self.coupon.pk)
+        coupons.release(self.coupon.pk)
+        self.assertTrue(coupons.redeem(self.coupon.pk))
+        self.assertFalse(coupons.redeem(self.coupon.pk))
+
+    def test_release_never_goes_below_zero(self):
+        coupons.release(self.coupon.pk)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 0)
+
+    def test_expired_coupon_is_not_redeemed(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(valid_until=timezone.now())
+        self.assertFalse(coupons.redeem(self.coupon.pk))
+
+    def test_used_up_coupon_is_dropped_from_the_cache(self):
+        self.assertEqual(coupons.get_coupon('SPRING'), self.coupon)
+        Coupon.objects.filter(pk=self.coupon.pk).update(times_used=2)
+        self.assertFalse(coupons.redeem(self.coupon.pk))
+        self.assertFalse(coupons.get_coupon('SPRING').is_valid())
+
+    def test_unknown_code(self):
+        self.assertIsNone(coupons.get_coupon('NOPE'))
+
+
+class PhotoCountTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+    def photo_counts(self):
+        return dict(UserProfile.objects.values_list('user__username', 'photo_count'))
+
+    def test_counts_follow_create_move_and_delete(self):
+        photo = make_photo(self.alice, 'lake')
+        self.assertEqual(self.photo_counts(), {'alice': 1, 'bob': 0})
+        photo.user = self.bob
+        photo.save()
+        self.assertEqual(self.photo_counts(), {'alice': 0, 'bob': 1})
+        photo.save()
+        self.assertEqual(self.photo_counts(), {'alice': 0, 'bob': 1})
+        photo.delete()
+        self.assertEqual(self.photo_counts(), {'alice': 0, 'bob': 0})
+
+    def test_gallery_of_a_user_without_a_profile(self):
+        make_photo(self.alice, 'lake')
+        UserProfile.objects.filter(user=self.alice).delete()
+        response = self.client.get(reverse('imageapp:user-image-detail', args=['alice']))
+        self.assertEqual(response.context['photo_count'], 1)
+
+
+class PhotoPriceTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = make_photo(User.objects.create(username='seller'), 'lake', price=20)
+
+    def prices(self):
+        return Photo.objects.values_list('effective_price', 'discount_percent').get(pk=self.photo.pk)
+
+    def test_partial_saves_keep_the_derived_prices_in_sync(self):
+        self.assertEqual(self.prices(), (20, 0))
+        self.photo.discount_price = 15
+        self.photo.save(update_fields=['discount_price'])
+        self.assertEqual(self.prices(), (15, 25))
+        self.photo.price = 30
+        self.photo.save(update_fields=['price'])
+        self.assertEqual(self.prices(), (15, 50))
+        self.photo.discount_price = None
+        self.photo.save(update_fields=['discount_price'])
+        self.assertEqual(self.prices(), (30, 0))
+
+    def test_unrelated_partial_saves_leave_the_prices_alone(self):
+        # a stale in-memory price must not overwrite the stored one
+        Photo.objects.filter(pk=self.photo.pk).update(price=40, effective_price=40)
+        self.photo.description = 'Lake at dawn'
+        self.photo.save(update_fields=['description'])
+        self.assertEqual(self.prices(), (40, 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PopularityTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        popularity._pending.clear()
+        self.addCleanup(popularity._pending.clear)
+        self.photo = make_photo(User.objects.create(username='seller'), 'lake')
+
+    def test_flush_writes_counters_and_scores(self):
+        popularity.record(self.photo.pk, 'views')
+        popularity.record(self.photo.pk, 'carts')
+        popularity.flush()
+        counters = PhotoPopularity.objects.get(photo=self.photo)
+        self.assertEqual((counters.views, counters.carts), (1, 1))
+        self.assertTrue(PhotoTrending.objects.filter(photo=self.photo).exists())
+        self.assertEqual(popularity._pending, {})
+
+    def test_failed_flush_keeps_the_counts(self):
+        popularity.record(self.photo.pk, 'views')
+        with mock.patch('imageapp.popularity.increment', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('imageapp.popularity', 'ERROR'):
+            popularity.try_flush()
+        popularity.record(self.photo.pk, 'views')
+        self.assertEqual(popularity._pending[self.photo.pk]['views'], 2)
+        self.assertFalse(PhotoPopularity.objects.exists())
+
+        popularity.flush()
+        self.assertEqual(PhotoPopularity.objects.get(photo=self.photo).views, 2)
+
+    @override_settings(POPULARITY_FLUSH_INTERVAL=0)
+    def test_recording_survives_a_failed_flush(self):
+        with mock.patch('imageapp.popularity.write', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('imageapp.popularity', 'ERROR'):
+            popularity.record(self.photo.pk, 'carts')
+        self.assertEqual(popularity._pending[self.photo.pk]['carts'], 1)
+
+    def test_rebuild_rescores_every_photo(self):
+        other = make_photo(self.photo.user, 'hills')
+        popularity.record(self.photo.pk, 'views')
+        popularity.record(other.pk, 'carts')
+        popularity.flush()
+        PhotoTrending.objects.update(score=0)
+        # a photo whose counters are all gone drops out of trending
+        PhotoPopularity.objects.filter(photo=other).delete()
+
+        self.assertEqual(popularity.rebuild(), 1)
+        trending = PhotoTrending.objects.get()
+        self.assertEqual(trending.photo_id, self.photo.pk)
+        self.assertNotEqual(trending.score, 0)
+
+
+class RateLimitStoreTests:
+    """Shared by the tests of each store, which set ``self.store``."""
+
+    def test_bucket_empties_and_refills(self):
+        # 2 tokens, one more every 10 seconds
+        self.assertEqual(self.store.take('k', 2, 0.1, 100.0), 0)
+        self.assertEqual(self.store.take('k', 2, 0.1, 100.0), 0)
+        self.assertAlmostEqual(self.store.take('k', 2, 0.1, 100.0), 10)
+        self.assertAlmostEqual(self.store.take('k', 2, 0.1, 104.0), 6)
+        self.assertEqual(self.store.take('k', 2, 0.1, 110.0), 0)
+        self.assertGreater(self.store.take('k', 2, 0.1, 110.0), 0)
+
+    def test_refill_stops_at_capacity(self):
+        self.store.take('k', 2, 0.1, 100.0)
+        for _ in range(2):
+            self.assertEqual(self.store.take('k', 2, 0.1, 10000.0), 0)
+        self.assertGreater(self.store.take('k', 2, 0.1, 10000.0), 0)
+
+    def test_keys_have_their_own_buckets(self):
+        self.store.take('a', 1, 0.1, 100.0)
+        self.assertGreater(self.store.take('a', 1, 0.1, 100.0), 0)
+        self.assertEqual(self.store.take('b', 1, 0.1, 100.0), 0)
+
+    def test_view_gets_a_429_with_retry_after(self):
+        calls = []
+
+        @ratelimit.ratelimit('2/m')
+        def view(request):
+            calls.append(request)
+            return HttpResponse()
+
+        factory = RequestFactory()
+        with override_settings(RATELIMIT_ENABLED=True), \
+                mock.patch('imageapp.ratelimit.get_store', return_value=self.store):
+            responses = [view(factory.post('/', REMOTE_ADDR='10.0.0.1')) for _ in range(3)]
+            other = view(factory.post('/', REMOTE_ADDR='10.0.0.2'))
+            read = view(factory.get('/', REMOTE_ADDR='10.0.0.1'))
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        # a token every 30 seconds
+        self.assertIn(int(responses[2]['Retry-After']), (30, 31))
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(read.status_code, 200)
+        self.assertEqual(len(calls), 4)
+
+
+class MemoryStoreTests(RateLimitStoreTests, SimpleTestCase):
+    def setUp(self):
+        self.store = ratelimit.MemoryStore()
+
+    def test_least_recently_used_buckets_are_dropped(self):
+        store = ratelimit.MemoryStore(maxsize=2)
+        store.take('a', 1, 0.1, 100.0)
+        store.take('b', 1, 0.1, 100.0)
+        store.take('c', 1, 0.1, 100.0)
+        # 'a' was dropped, so its bucket is full again
+        self.assertEqual(store.take('a', 1, 0.1, 100.0), 0)
+        self.assertGreater(store.take('c', 1, 0.1, 100.0), 0)
+
+
+class SQLiteStoreTests(RateLimitStoreTests, SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'ratelimit.sqlite3')
+        self.store = ratelimit.SQLiteStore(self.path)
+
+    def test_stores_on_the_same_file_share_buckets(self):
+        other = ratelimit.SQLiteStore(self.path)
+        self.assertEqual(self.store.take('k', 1, 0.1, 100.0), 0)
+        self.assertGreater(other.take('k', 1, 0.1, 100.0), 0)
+
+    def test_threads_never_take_more_than_the_capacity(self):
+        taken = []
+
+        def worker():
+            store = ratelimit.SQLiteStore(self.path)
+            for _ in range(10):
+                if store.take('k', 25, 0.001, 100.0) == 0:
+                    taken.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(taken), 25)
+
+
+@override_settings(RATELIMIT_ENABLED=True, RATELIMITS={'imageapp:add-to-cart': ('1/m', ('GET',))})
+class RateLimitMiddlewareTests(MediaTestCase):
+    def test_limited_url_gets_a_429_before_the_view(self):
+        photo = make_photo(User.objects.create(username='seller'), 'lake')
+        url = reverse('imageapp:add-to-cart', args=[photo.slug])
+        with mock.patch('imageapp.ratelimit.get_store', return_value=ratelimit.MemoryStore()):
+            self.assertEqual(self.client.get(url).status_code, 302)
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(reverse('imageapp:order-summary')).status_code, 200)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response['Retry-After']), (60, 61))
+        cart = signing.loads(self.client.cookies[settings.CART_COOKIE_NAME].value, salt=COOKIE_SALT)
+        self.assertEqual(cart, {str(photo.pk): 1})
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.now = 1000.0
+        clock = mock.patch('imageapp.cache.time.monotonic', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def make_cache(self, **options):
+        options = dict({'L1_TTL': 5, 'VERSION_TTL': 1}, **options)
+        return TwoTierCache(self.location, {'TIMEOUT': 300, 'OPTIONS': options})
+
+    def test_other_workers_see_a_set_once_their_l1_expires(self):
+        worker, other = self.make_cache(), self.make_cache()
+        worker.set('photo:1', 'old')
+        self.assertEqual(other.get('photo:1'), 'old')
+        worker.set('photo:1', 'new')
+        self.assertEqual(other.get('photo:1'), 'old')
+        self.now += 5
+        self.assertEqual(other.get('photo:1'), 'new')
+        self.assertEqual(metrics.snapshot(), {'cache.photo.l2_hits': 2, 'cache.photo.l1_hits': 1})
+
+    def test_bump_invalidates_the_prefix_in_every_worker(self):
+        worker, other = self.make_cache(), self.make_cache()
+        worker.set('photo:1', 'a')
+        worker.set('photo:2', 'b')
+        worker.set('trending:photos', 'c')
+        self.assertEqual(other.get('photo:1'), 'a')
+
+        worker.bump('photo')
+        self.assertIsNone(worker.get('photo:1'))
+        # the other worker re-reads the version after VERSION_TTL
+        self.now += 1
+        self.assertIsNone(other.get('photo:1'))
+        self.assertIsNone(other.get('photo:2'))
+        self.assertEqual(other.get('trending:photos'), 'c')
+
+    def test_only_invalidated_prefixes_are_versioned(self):
+        cache = self.make_cache()
+        self.assertEqual(key_prefix('photo:1'), 'photo')
+        self.assertEqual(key_prefix('template.cache.x.abc'), 'template.cache.x')
+        self.assertEqual(key_prefix('a1b2c3d4'), 'default')
+
+        cache.set('photo:1', 'a')
+        cache.set('template.cache.x.abc', 'b')
+        cache.set('a1b2c3d4', 'c')
+        self.assertEqual(set(cache._versions), {'photo'})
+        self.assertEqual(cache.l2.get('template.cache.x.abc'), 'b')
+        self.assertEqual(cache.get('a1b2c3d4'), 'c')
+        self.assertEqual(metrics.snapshot()['cache.default.l1_hits'], 1)
+        with self.assertRaises(ValueError):
+            cache.bump('template.cache.x')
+
+    def test_l1_is_bounded_by_bytes(self):
+        cache = self.make_cache(L1_MAX_BYTES=3000)
+        for n in range(5):
+            cache.set(f"photo:{n}", b'x' * 1000)
+        self.assertLessEqual(cache._l1_bytes, 3000)
+        self.assertEqual(len(cache._l1), 2)
+        self.assertEqual(metrics.snapshot()['cache.photo.evictions'], 3)
+        # evicted entries are still in L2
+        self.assertEqual(cache.get('photo:0'), b'x' * 1000)
+
+    def test_entries_larger_than_l1_only_go_to_l2(self):
+        cache = self.make_cache(L1_MAX_BYTES=100)
+        cache.set('photo:1', b'x' * 1000)
+        self.assertEqual(len(cache._l1), 0)
+        self.assertEqual(cache.get('photo:1'), b'x' * 1000)
+
+    def test_excluded_prefixes_skip_l1(self):
+        worker, other = self.make_cache(L1_EXCLUDE=['session']), self.make_cache(L1_EXCLUDE=['session'])
+        worker.set('session:abc', 1)
+        self.assertEqual(other.get('session:abc'), 1)
+        worker.set('session:abc', 2)
+        self.assertEqual(other.get('session:abc'), 2)
+
+    def test_has_key_is_not_counted_as_a_read(self):
+        cache = self.make_cache()
+        cache.set('photo:1', 'a')
+        self.assertTrue(cache.has_key('photo:1'))
+        self.assertTrue(self.make_cache().has_key('photo:1'))
+        self.assertFalse(cache.has_key('photo:2'))
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_delete_is_seen_by_the_worker_that_deleted(self):
+        cache = self.make_cache()
+        cache.set('photo:1', 'a')
+        cache.delete('photo:1')
+        self.assertIsNone(cache.get('photo:1'))
+
+
+class RenditionTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = make_photo(User.objects.create(username='seller'), 'lake')
+
+    def test_signed_url_is_served(self):
+        response = self.client.get(self.photo.get_rendition_url(4, 3, 'png'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (4, 3))
+
+    def test_bad_signatures_are_rejected(self):
+        signature = renditions.sign(self.photo.pk, 4, 3, 'png')
+        self.assertTrue(renditions.is_valid_request(self.photo.pk, 4, 3, 'png', signature))
+        # the signature is bound to every parameter
+        self.assertFalse(renditions.is_valid_request(self.photo.pk, 8, 6, 'png', signature))
+        self.assertFalse(renditions.is_valid_request(self.photo.pk + 1, 4, 3, 'png', signature))
+        self.assertFalse(renditions.is_valid_request(self.photo.pk, 4, 3, 'jpeg', signature))
+        self.assertFalse(renditions.is_valid_request(self.photo.pk, 4, 3, 'png', 'x' * 20))
+        # signatures don't expire, but rotating SECRET_KEY revokes them all
+        with override_settings(SECRET_KEY='rotated'):
+            self.assertFalse(renditions.is_valid_request(self.photo.pk, 4, 3, 'png', signature))
+
+        url = reverse('imageapp:photo-rendition', kwargs={
+            'pk': self.photo.pk, 'width': 4, 'height': 3, 'fmt': 'png', 'signature': 'x' * 20})
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertFalse(os.path.exists(settings.RENDITION_CACHE_DIR))
+
+    def test_signed_sizes_are_still_bounded(self):
+        width = settings.RENDITION_MAX_SIZE[0] + 1
+        signature = renditions.sign(self.photo.pk, width, 3, 'png')
+        self.assertFalse(renditions.is_valid_request(self.photo.pk, width, 3, 'png', signature))
+        signature = renditions.sign(self.photo.pk, 4, 3, 'gif')
+        self.assertFalse(renditions.is_valid_request(self.photo.pk, 4, 3, 'gif', signature))
+
+    def test_cache_path_changes_with_the_source(self):
+        path = renditions.cache_path(self.photo, 4, 3, 'png')
+        self.assertEqual(renditions.cache_path(self.photo, 4, 3, 'png'), path)
+        self.photo.cropping = '0,0,4,4'
+        cropped = renditions.cache_path(self.photo, 4, 3, 'png')
+        self.assertNotEqual(cropped, path)
+        self.photo.image.name = 'image_repository/other.png'
+        self.assertNotIn(renditions.cache_path(self.photo, 4, 3, 'png'), (path, cropped))
+        self.assertNotEqual(renditions.cache_path(self.photo, 4, 3, 'jpeg'), path)
+
+    def test_evict_drops_the_least_recently_used_down_to_90_percent(self):
+        directory = renditions.rendition_dir(self.photo.pk)
+        os.makedirs(directory)
+        paths = []
+        for n in range(10):
+            path = os.path.join(directory, f"{n}.png")
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (1000 + n, 1000 + n))
+            paths.append(path)
+        # still being written, never evicted
+        with open(os.path.join(directory, 'partial.tmp'), 'wb') as f:
+            f.write(b'x' * 100)
+
+        self.assertEqual(renditions.evict(max_bytes=500), 400)
+        self.assertEqual([os.path.exists(path) for path in paths], [False] * 6 + [True] * 4)
+        self.assertTrue(os.path.exists(os.path.join(directory, 'partial.tmp')))
+        # already below the target, nothing more to do
+        self.assertEqual(renditions.evict(max_bytes=500), 400)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        lock_dir = override_settings(SINGLE_FLIGHT_LOCK_DIR=directory)
+        lock_dir.enable()
+        self.addCleanup(lock_dir.disable)
+        self.path = locks._lock_path('test:key')
+
+    def test_lock_file_left_by_a_crashed_worker_is_reused(self):
+        with open(self.path, 'w') as f:
+            f.write('12345')
+        os.utime(self.path, (0, 0))
+        self.assertEqual(locks.single_flight('test', 'key', lambda: None, lambda: 'made'), 'made')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_lock_of_a_killed_process_is_released(self):
+        holder = subprocess.Popen([sys.executable, '-c', (
+            "import fcntl, os, sys, time\n"
+            f"fd = os.open({self.path!r}, os.O_CREAT | os.O_RDWR)\n"
+            "fcntl.flock(fd, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "time.sleep(60)\n"
+        )], stdout=subprocess.PIPE)
+        self.addCleanup(holder.stdout.close)
+        self.assertEqual(holder.stdout.readline().strip(), b'locked')
+        self.assertIsNone(locks._acquire(self.path))
+        holder.kill()
+        holder.wait()
+        fd = locks._acquire(self.path)
+        self.assertIsNotNone(fd)
+        locks._release(self.path, fd)
+
+    def test_a_long_render_keeps_its_lock(self):
+        # however old the lock file is, a held lock is never taken over
+        fd = locks._acquire(self.path)
+        self.addCleanup(locks._release, self.path, fd)
+        os.utime(self.path, (0, 0))
+        produced = []
+        result = locks.single_flight('test', 'key', lambda: None, lambda: produced.append(1), wait=0.1)
+        self.assertIsNone(result)
+        self.assertEqual(produced, [])
+
+    def test_waiter_on_a_removed_lock_file_tries_again(self):
+        open(self.path, 'w').close()
+        flock = fcntl.flock
+        locked = []
+
+        def racing_flock(fd, operation):
+            if not locked:
+                # the holder removes and unlocks the file we just opened
+                os.unlink(self.path)
+            locked.append(fd)
+            return flock(fd, operation)
+
+        with mock.patch('fcntl.flock', racing_flock):
+            fd = locks._acquire(self.path)
+        self.addCleanup(locks._release, self.path, fd)
+        self.assertEqual(len(locked), 2)
+        self.assertEqual(os.fstat(fd).st_ino, os.stat(self.path).st_ino)
+
+    def test_concurrent_callers_produce_once(self):
+        done = threading.Event()
+        produced = []
+        results = []
+
+        def produce():
+            produced.append(1)
+            time.sleep(0.2)
+            done.set()
+            return 'made'
+
+        def caller():
+            results.append(locks.single_flight(
+                'test', 'key', lambda: 'made' if done.is_set() else None, produce, wait=5))
+
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(produced, [1])
+        self.assertEqual(results, ['made'] * 5)
+
+
+class GcMediaTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.uploads = os.path.join(self.media_root, 'image_repository')
+        os.makedirs(self.uploads)
+        for n in range(6):
+            path = os.path.join(self.uploads, f"orphan{n}.png")
+            open(path, 'wb').close()
+            os.utime(path, (0, 0))
+        self.kept = make_photo(User.objects.create(username='seller'), 'kept')
+        os.utime(self.kept.image.path, (0, 0))
+        self.state_file = os.path.join(self.media_root, 'gc.json')
+
+    def gc(self, **options):
+        call_command('gc_media', state_file=self.state_file, batch_size=2, stdout=io.StringIO(), **options)
+
+    def listing(self):
+        with os.scandir(self.uploads) as entries:
+            return [entry.name for entry in entries]
+
+    def test_deletes_unreferenced_originals_only(self):
+        self.gc()
+        self.assertEqual(self.listing(), [os.path.basename(self.kept.image.name)])
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_resumes_after_the_checkpoint_in_directory_order(self):
+        names = self.listing()
+        with open(self.state_file, 'w') as f:
+            json.dump({'phase': 'uploads', 'after': names[2]}, f)
+        self.gc()
+        kept = set(names[:3]) | {os.path.basename(self.kept.image.name)}
+        self.assertEqual(set(self.listing()), kept)
+
+    def test_starts_over_if_the_checkpoint_is_gone(self):
+        with open(self.state_file, 'w') as f:
+            json.dump({'phase': 'uploads', 'after': 'deleted-meanwhile.png'}, f)
+        self.gc()
+        self.assertEqual(self.listing(), [os.path.basename(self.kept.image.name)])
+
+    def test_checkpoints_on_a_file_that_is_still_there(self):
+        saved = []
+        with mock.patch('imageapp.management.commands.gc_media.Command.save_state',
+                        lambda command, state: saved.append(state)):
+            self.gc()
+        # '' while every file so far was deleted, which resumes from the start
+        remaining = set(self.listing()) | {''}
+        uploads = [state['after'] for state in saved if state['phase'] == 'uploads']
+        self.assertEqual(len(uploads), 4)
+        self.assertTrue(all(after in remaining for after in uploads))
+
+
+class PaymentIdempotencyTests(MediaTestCase):
+    """Payments against the fake Stripe API of ``manage.py fake_stripe``, served in-process."""
+
+    def setUp(self):
+        super().setUp()
+        self.stripe = FakeStripe()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self.stripe))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        stripe = payments.get_stripe()
+        self.addCleanup(setattr, stripe, 'api_base', stripe.api_base)
+        self.addCleanup(setattr, stripe, 'api_key', stripe.api_key)
+        self.addCleanup(setattr, payments, '_configured', False)
+        payments._configured = False
+        stripe_settings = override_settings(
+            STRIPE_API_BASE=f"http://127.0.0.1:{server.server_address[1]}",
+            STRIPE_SECRET_KEY='sk_test_fake',
+            RATELIMIT_ENABLED=False,
+        )
+        stripe_settings.enable()
+        self.addCleanup(stripe_settings.disable)
+
+        self.user = User.objects.create(username='buyer')
+        self.client.force_login(self.user)
+        photo = make_photo(User.objects.create(username='seller'), 'lake', price=12)
+        self.order = Order.objects.create(user=self.user, ordered_date=timezone.now())
+        self.order.photos.add(OrderPhoto.objects.create(user=self.user, photo=photo, quantity=2))
+        self.url = reverse('imageapp:payment', kwargs={'payment_option': 'stripe'})
+
+    def pay(self, **data):
+        data = dict({'idempotency_key': 'key-1', 'stripeToken': 'tok_visa'}, **data)
+        # only the messages of this request, not ones left from the previous
+        self.client.cookies.pop('messages', None)
+        response = self.client.post(self.url, data)
+        return response, [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_duplicate_submission_is_charged_once(self):
+        response, first = self.pay()
+        self.assertRedirects(response, reverse('imageapp:photo-list'), fetch_redirect_response=False)
+        self.assertEqual(first, ["Your order was successful!"])
+
+        response, second = self.pay()
+        self.assertRedirects(response, reverse('imageapp:photo-list'), fetch_redirect_response=False)
+        self.assertEqual(second, ["Your order was successful!"])
+
+        self.assertEqual(self.stripe.stats['charges'], 1)
+        self.assertEqual(self.stripe.stats['charged_amount'], 2400)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual(attempt.status, PaymentAttempt.SUCCEEDED)
+        self.assertEqual(Payment.objects.get().stripe_charge_id, attempt.charge_id)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.ordered)
+
+    def test_same_key_with_other_data_is_rejected(self):
+        self.pay()
+        response, replayed = self.pay(stripeToken='tok_other')
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(replayed, ["This payment form was already submitted. Please try again."])
+        self.assertEqual(self.stripe.stats['charges'], 1)
+        self.assertEqual(PaymentAttempt.objects.count(), 1)
+
+    def test_declined_payment_releases_the_coupon(self):
+        coupon = Coupon.objects.create(code='SPRING', amount=5, max_uses=1)
+        Order.objects.filter(pk=self.order.pk).update(coupon=coupon)
+
+        response, declined = self.pay(stripeToken=DECLINED_TOKEN)
+        self.assertEqual(declined, ["Your card was declined."])
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_used, 0)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual((attempt.status, attempt.charge_id), (PaymentAttempt.FAILED, ''))
+
+        # the same form again replays the failure without charging
+        response, replayed = self.pay(stripeToken=DECLINED_TOKEN)
+        self.assertEqual(replayed, ["Your card was declined."])
+        self.assertEqual(self.stripe.stats['declined'], 1)
+
+        # and a new attempt can still use the coupon
+        self.pay(idempotency_key='key-2')
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_used, 1)
+        self.assertEqual(self.stripe.stats['charged_amount'], 1900)
+
+    def test_coupon_is_kept_when_the_customer_was_charged(self):
+        coupon = Coupon.objects.create(code='SPRING', amount=5, max_uses=1)
+        Order.objects.filter(pk=self.order.pk).update(coupon=coupon)
+        with mock.patch('imageapp.views.PaymentView.complete', side_effect=RuntimeError('boom')):
+            self.pay()
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_used, 1)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual(attempt.status, PaymentAttempt.PENDING)
+        self.assertTrue(attempt.charge_id)
+
+        response, replayed = self.pay()
+        self.assertEqual(replayed, ["Your payment is already being processed."])
+        self.assertEqual(self.stripe.stats['charges'], 1)
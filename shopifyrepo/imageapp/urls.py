@@ -1,6 +1,15 @@
 from django.urls import path
 from django.conf.urls import url
-from . import views
+from django.conf import settings
+from . import api, views
+
+if settings.ASYNC_VIEWS:
+    from . import async_views
+    photo_rendition = async_views.photo_rendition
+    payment = async_views.payment
+else:
+    photo_rendition = views.photo_rendition
+    payment = views.PaymentView.as_view()
 
 app_name = "imageapp"
 
@@ -11,12 +20,21 @@ urlpatterns = [
     path("photo-delete/<int:pk>/", views.PhotoDeleteView.as_view(), name="photo-delete"),
     path('order-summary/', views.OrderSummaryView.as_view(), name='order-summary'),
     path('photo-details/<slug:slug>/', views.PhotoDetailView.as_view(), name='photo-details'),
+    path('img/<int:pk>/<int:width>x<int:height>/<str:fmt>/<str:signature>/', photo_rendition,
+         name='photo-rendition'),
+    path('dashboard/', views.SalesDashboardView.as_view(), name='sales-dashboard'),
+    path('export/orders/', views.export_orders_view, name='export-orders'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('api/photos/', api.photo_list, name='api-photo-list'),
+    path('api/photos/batch/', api.photo_batch, name='api-photo-batch'),
+    path('api/photos/<slug:slug>/', api.photo_detail, name='api-photo-detail'),
+    path('api/users/<str:username>/photos/', api.user_photo_list, name='api-user-photo-list'),
     path('add-to-cart/<slug:slug>/', views.add_to_cart, name='add-to-cart'),
     path('add-coupon/', views.AddCouponView.as_view(), name='add-coupon'),
     path('remove-from-cart/<slug:slug>/', views.remove_from_cart, name='remove-from-cart'),
     path('remove-item-from-cart/<slug:slug>/', views.remove_single_item_from_cart,
          name='remove-single-item-from-cart'),
-    path('payment/<payment_option>/', views.PaymentView.as_view(), name='payment'),
+    path('payment/<payment_option>/', payment, name='payment'),
     url(r"^(?P<username>[-\w]+)$", views.UserImageDetailView.as_view(), name="user-image-detail"),
     path("user-image-edit/<int:pk>/", views.UserImageEditView.as_view(), name="user-image-edit"),
 
@@ -1,4 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import (
+    FileResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+)
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.models import User
@@ -6,8 +9,9 @@ from django.views import View
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib import messages
 from django.utils import timezone
-from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
+from django.db import transaction
 from django.views.generic import (
     CreateView, 
     ListView, 
@@ -20,17 +24,18 @@ from .models import (
     Photo, 
     Order, 
     OrderPhoto, 
-    Coupon, 
     Payment, 
     UserProfile,
     Address,
+    PaymentAttempt,
 )
 from .forms import (
     PaymentForm, 
     CouponForm, 
     CheckoutForm,
 )
-import stripe
+from . import coupons, exports, metrics, payments, popularity, renditions, sales
+from .cart import get_cart
 
 
 
@@ -72,17 +77,89 @@ class PhotoDetailView(DetailView):
     context_object_name = "photo"
     template_name = "imageapp/image_detail.html"
 
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        popularity.record(self.object.pk, 'views')
+        return response
+
 
 class PhotoListView(ListView):
     model = Photo
     paginate_by = 10
     context_object_name = "photos"
     template_name = "imageapp/image_list.html"
+    # ?sort= -> (label, ordering); each ordering matches an index on Photo
+    sorts = {
+        'newest': ("Newest", ('-created_at', '-id')),
+        'price-asc': ("Price: low to high", ('effective_price', 'id')),
+        'price-desc': ("Price: high to low", ('-effective_price', '-id')),
+        'discount': ("Biggest discount", ('-discount_percent', '-id')),
+    }
+    default_sort = 'newest'
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in self.sorts else self.default_sort
+
+    def get_ordering(self):
+        return self.sorts[self.get_sort()][1]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sort'] = self.get_sort()
+        context['sorts'] = [(sort, label) for sort, (label, ordering) in self.sorts.items()]
+        if context['page_obj'].number == 1:
+            context['trending'] = popularity.trending()
+        return context
+
+
+
+def photo_rendition(request, pk, width, height, fmt, signature):
+    if not renditions.is_valid_request(pk, width, height, fmt, signature):
+        return HttpResponseForbidden("Invalid rendition signature")
+    photo = get_object_or_404(Photo, pk=pk)
+    path = renditions.get_rendition(photo, width, height, fmt)
+    if path is None:
+        # another worker is still rendering it, serve the original meanwhile
+        response = redirect(photo.image.url)
+        response['Cache-Control'] = 'no-store'
+        return response
+    response = FileResponse(open(path, 'rb'), content_type=renditions.content_type(fmt))
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+
+@staff_member_required
+def metrics_view(request):
+    return JsonResponse(metrics.snapshot())
 
 
 
-class OrderSummaryView(LoginRequiredMixin, View):
+@staff_member_required
+def export_orders_view(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return HttpResponseBadRequest("format must be one of: " + ", ".join(exports.FORMATS))
+    try:
+        start = exports.parse_day(request.GET['start']) if request.GET.get('start') else None
+        end = exports.parse_day(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return HttpResponseBadRequest("start and end must be YYYY-MM-DD")
+    response = StreamingHttpResponse(exports.export(fmt, start, end),
+                                     content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+    return response
+
+
+
+class OrderSummaryView(View):
     def get(self, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            context = {
+                'object': get_cart(self.request)
+            }
+            return render(self.request, 'imageapp/order_summary.html', context)
         try:
             order = Order.objects.get(user=self.request.user, ordered=False)
             context = {
@@ -95,9 +172,19 @@ class OrderSummaryView(LoginRequiredMixin, View):
 
 
 
-@login_required
 def add_to_cart(request, slug):
     photo = get_object_or_404(Photo, slug=slug)
+    popularity.record(photo.pk, 'carts')
+    if not request.user.is_authenticated:
+        cart = get_cart(request)
+        updated = photo in cart
+        if not cart.add(photo):
+            messages.warning(request, "Your cart is full.")
+        elif updated:
+            messages.info(request, "This item quantity was updated.")
+        else:
+            messages.info(request, "This item was added to your cart.")
+        return redirect("imageapp:order-summary")
     order_photo, created = OrderPhoto.objects.get_or_create(
         photo=photo,
         user=request.user,
@@ -125,9 +212,16 @@ def add_to_cart(request, slug):
         return redirect("imageapp:order-summary")
 
 
-@login_required
 def remove_from_cart(request, slug):
     photo = get_object_or_404(Photo, slug=slug)
+    if not request.user.is_authenticated:
+        cart = get_cart(request)
+        if photo in cart:
+            cart.remove(photo)
+            messages.info(request, "This item was removed from your cart.")
+        else:
+            messages.info(request, "This item was not in your cart")
+        return redirect("imageapp:order-summary")
     order_qs = Order.objects.filter(
         user=request.user,
         ordered=False
@@ -154,9 +248,16 @@ def remove_from_cart(request, slug):
 
 
 
-@login_required
 def remove_single_item_from_cart(request, slug):
     photo = get_object_or_404(Photo, slug=slug)
+    if not request.user.is_authenticated:
+        cart = get_cart(request)
+        if photo in cart:
+            cart.remove_single(photo)
+            messages.info(request, "This item quantity was updated.")
+        else:
+            messages.info(request, "This item was not in your cart")
+        return redirect("imageapp:order-summary")
     order_qs = Order.objects.filter(
         user=request.user,
         ordered=False
@@ -186,7 +287,15 @@ def remove_single_item_from_cart(request, slug):
 
 
 
-class CheckoutView(View):
+def get_default_addresses(user):
+    # one query for both the default shipping and billing address
+    defaults = {}
+    for address in Address.objects.filter(user=user, default=True, address_type__in=('S', 'B')):
+        defaults.setdefault(address.address_type, address)
+    return defaults
+
+
+class CheckoutView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         try:
             order = Order.objects.get(user=self.request.user, ordered=False)
@@ -195,26 +304,17 @@ class CheckoutView(View):
                 'form': form,
                 'couponform': CouponForm(),
                 'order': order,
-                'DISPLAY_COUPON_FORM': True
+                'DISPLAY_COUPON_FORM': True,
+                'template_cache_version': settings.TEMPLATE_CACHE_VERSION,
             }
 
-            shipping_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='S',
-                default=True
-            )
-            if shipping_address_qs.exists():
+            defaults = get_default_addresses(self.request.user)
+            if 'S' in defaults:
                 context.update(
-                    {'default_shipping_address': shipping_address_qs[0]})
-
-            billing_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='B',
-                default=True
-            )
-            if billing_address_qs.exists():
+                    {'default_shipping_address': defaults['S']})
+            if 'B' in defaults:
                 context.update(
-                    {'default_billing_address': billing_address_qs[0]})
+                    {'default_billing_address': defaults['B']})
             return render(self.request, "imageapp/checkout.html", context)
         except ObjectDoesNotExist:
             messages.info(self.request, "You do not have an active order")
@@ -222,147 +322,117 @@ class CheckoutView(View):
 
     def post(self, *args, **kwargs):
         form = CheckoutForm(self.request.POST or None)
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            if form.is_valid():
-
-                use_default_shipping = form.cleaned_data.get(
-                    'use_default_shipping')
-                if use_default_shipping:
-                    print("Using the defualt shipping address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='S',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        shipping_address = address_qs[0]
-                        order.shipping_address = shipping_address
-                        order.save()
-                    else:
-                        messages.info(
-                            self.request, "No default shipping address available")
-                        return redirect('imageapp:checkout')
-                else:
-                    print("User is entering a new shipping address")
-                    shipping_address1 = form.cleaned_data.get(
-                        'shipping_address')
-                    shipping_address2 = form.cleaned_data.get(
-                        'shipping_address2')
-                    shipping_country = form.cleaned_data.get(
-                        'shipping_country')
-                    shipping_zip = form.cleaned_data.get('shipping_zip')
-
-                    if is_valid_form([shipping_address1, shipping_country, shipping_zip]):
-                        shipping_address = Address(
-                            user=self.request.user,
-                            street_address=shipping_address1,
-                            apartment_address=shipping_address2,
-                            country=shipping_country,
-                            zip=shipping_zip,
-                            address_type='S'
-                        )
-                        shipping_address.save()
-
-                        order.shipping_address = shipping_address
-                        order.save()
-
-                        set_default_shipping = form.cleaned_data.get(
-                            'set_default_shipping')
-                        if set_default_shipping:
-                            shipping_address.default = True
-                            shipping_address.save()
-
-                    else:
-                        messages.info(
-                            self.request, "Please fill in the required shipping address fields")
-
-                use_default_billing = form.cleaned_data.get(
-                    'use_default_billing')
-                same_billing_address = form.cleaned_data.get(
-                    'same_billing_address')
-
-                if same_billing_address:
-                    billing_address = shipping_address
-                    billing_address.pk = None
-                    billing_address.save()
-                    billing_address.address_type = 'B'
-                    billing_address.save()
-                    order.billing_address = billing_address
-                    order.save()
-
-                elif use_default_billing:
-                    print("Using the defualt billing address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='B',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        billing_address = address_qs[0]
-                        order.billing_address = billing_address
-                        order.save()
-                    else:
-                        messages.info(
-                            self.request, "No default billing address available")
-                        return redirect('imageapp:checkout')
-                else:
-                    print("User is entering a new billing address")
-                    billing_address1 = form.cleaned_data.get(
-                        'billing_address')
-                    billing_address2 = form.cleaned_data.get(
-                        'billing_address2')
-                    billing_country = form.cleaned_data.get(
-                        'billing_country')
-                    billing_zip = form.cleaned_data.get('billing_zip')
-
-                    if is_valid_form([billing_address1, billing_country, billing_zip]):
-                        billing_address = Address(
-                            user=self.request.user,
-                            street_address=billing_address1,
-                            apartment_address=billing_address2,
-                            country=billing_country,
-                            zip=billing_zip,
-                            address_type='B'
-                        )
-                        billing_address.save()
-
-                        order.billing_address = billing_address
-                        order.save()
-
-                        set_default_billing = form.cleaned_data.get(
-                            'set_default_billing')
-                        if set_default_billing:
-                            billing_address.default = True
-                            billing_address.save()
-
-                    else:
-                        messages.info(
-                            self.request, "Please fill in the required billing address fields")
-
-                payment_option = form.cleaned_data.get('payment_option')
-
-                if payment_option == 'S':
-                    return redirect('imageapp:payment', payment_option='stripe')
-                elif payment_option == 'P':
-                    return redirect('imageapp:payment', payment_option='paypal')
-                else:
-                    messages.warning(
-                        self.request, "Invalid payment option selected")
-                    return redirect('imageapp:checkout')
-        except ObjectDoesNotExist:
+        if not form.is_valid():
+            messages.warning(self.request, "Please fill in the checkout form correctly")
+            return redirect('imageapp:checkout')
+
+        data = form.cleaned_data
+        user = self.request.user
+        order_pk = Order.objects.filter(user=user, ordered=False).values_list('pk', flat=True).first()
+        if order_pk is None:
             messages.warning(self.request, "You do not have an active order")
             return redirect("imageapp:order-summary")
 
+        defaults = {}
+        if data.get('use_default_shipping') or data.get('use_default_billing'):
+            defaults = get_default_addresses(user)
+        new_addresses = []
+
+        if data.get('use_default_shipping'):
+            shipping_address = defaults.get('S')
+            if shipping_address is None:
+                messages.info(
+                    self.request, "No default shipping address available")
+                return redirect('imageapp:checkout')
+        else:
+            if not is_valid_form([data.get('shipping_address'), data.get('shipping_country'),
+                                  data.get('shipping_zip')]):
+                messages.info(
+                    self.request, "Please fill in the required shipping address fields")
+                return redirect('imageapp:checkout')
+            shipping_address = Address(
+                user=user,
+                street_address=data.get('shipping_address'),
+                apartment_address=data.get('shipping_address2'),
+                country=data.get('shipping_country'),
+                zip=data.get('shipping_zip'),
+                address_type='S',
+                default=bool(data.get('set_default_shipping'))
+            )
+            new_addresses.append(shipping_address)
+
+        if data.get('same_billing_address'):
+            billing_address = Address(
+                user=user,
+                street_address=shipping_address.street_address,
+                apartment_address=shipping_address.apartment_address,
+                country=shipping_address.country,
+                zip=shipping_address.zip,
+                address_type='B',
+                default=shipping_address.default
+            )
+            new_addresses.append(billing_address)
+        elif data.get('use_default_billing'):
+            billing_address = defaults.get('B')
+            if billing_address is None:
+                messages.info(
+                    self.request, "No default billing address available")
+                return redirect('imageapp:checkout')
+        else:
+            if not is_valid_form([data.get('billing_address'), data.get('billing_country'),
+                                  data.get('billing_zip')]):
+                messages.info(
+                    self.request, "Please fill in the required billing address fields")
+                return redirect('imageapp:checkout')
+            billing_address = Address(
+                user=user,
+                street_address=data.get('billing_address'),
+                apartment_address=data.get('billing_address2'),
+                country=data.get('billing_country'),
+                zip=data.get('billing_zip'),
+                address_type='B',
+                default=bool(data.get('set_default_billing'))
+            )
+            new_addresses.append(billing_address)
+
+        # only writes in the transaction, the first of them taking SQLite's
+        # write lock, so it never has to upgrade a read lock under load
+        with transaction.atomic():
+            for address in new_addresses:
+                address.save()
+            updated = Order.objects.filter(pk=order_pk, ordered=False).update(
+                shipping_address=shipping_address, billing_address=billing_address)
+            if not updated:
+                # paid in another tab in the meantime
+                transaction.set_rollback(True)
+        if not updated:
+            messages.warning(self.request, "You do not have an active order")
+            return redirect("imageapp:order-summary")
+
+        payment_option = data.get('payment_option')
+
+        if payment_option == 'S':
+            return redirect('imageapp:payment', payment_option='stripe')
+        elif payment_option == 'P':
+            return redirect('imageapp:payment', payment_option='paypal')
+        else:
+            messages.warning(
+                self.request, "Invalid payment option selected")
+            return redirect('imageapp:checkout')
+
+
+class PaymentView(LoginRequiredMixin, View):
+    redeemed_coupon_id = None
 
-class PaymentView(View):
     def get(self, *args, **kwargs):
+        stripe = payments.get_stripe()
         order = Order.objects.get(user=self.request.user, ordered=False)
         if order.billing_address:
             context = {
                 'order': order,
                 'DISPLAY_COUPON_FORM': False,
-                'STRIPE_PUBLIC_KEY' : settings.STRIPE_PUBLIC_KEY
+                'STRIPE_PUBLIC_KEY' : settings.STRIPE_PUBLIC_KEY,
+                'idempotency_key': payments.new_key()
             }
             userprofile = self.request.user.userprofile
             if userprofile.one_click_purchasing:
@@ -385,140 +455,169 @@ class PaymentView(View):
             return redirect("imageapp:checkout")
 
     def post(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        stripe = payments.get_stripe()
+        pending = self.begin()
+        if not isinstance(pending, payments.PendingPayment):
+            return pending
+        try:
+            customer_id = self.create_customer(stripe, pending)
+            if customer_id:
+                self.save_customer(pending, customer_id)
+            pending.charge = self.create_charge(stripe, pending)
+            return self.complete(pending)
+        except Exception as e:
+            return self.failed(pending.attempt, payments.error_message(e), pending.charge)
+
+    # post() is split into steps so async_views.payment can run the provider
+    # calls off the database thread; only begin/save_customer/complete/failed
+    # touch the database
+
+    def begin(self):
+        """Claim the payment attempt, returning a PendingPayment or a response."""
         form = PaymentForm(self.request.POST)
+        if not form.is_valid():
+            messages.warning(self.request, "Invalid data received")
+            return redirect("/payment/stripe/")
+
+        key = form.cleaned_data.get('idempotency_key')
+        token = form.cleaned_data.get('stripeToken')
+        save = form.cleaned_data.get('save')
+        use_default = form.cleaned_data.get('use_default')
+        fingerprint = payments.fingerprint(self.request.user, token, save, use_default)
+
+        # a duplicate submission gets the stored outcome without
+        # touching the order or the payment provider
+        attempt = payments.get_attempt(self.request.user, key)
+        if attempt is not None:
+            return self.replay(attempt, fingerprint)
+
+        try:
+            order = Order.objects.get(user=self.request.user, ordered=False)
+        except ObjectDoesNotExist:
+            messages.warning(self.request, "You do not have an active order")
+            return redirect("imageapp:photo-list")
+
+        attempt, created = payments.claim_attempt(key, self.request.user, order, fingerprint)
+        if not created:
+            return self.replay(attempt, fingerprint)
+
+        # count the coupon use before charging; failed() gives it back
+        if order.coupon_id:
+            if not coupons.redeem(order.coupon_id):
+                Order.objects.filter(pk=order.pk).update(coupon=None)
+                return self.failed(
+                    attempt, "Your coupon is no longer valid and was removed from your order.")
+            self.redeemed_coupon_id = order.coupon_id
+
         userprofile = UserProfile.objects.get(user=self.request.user)
-        if form.is_valid():
-            token = form.cleaned_data.get('stripeToken')
-            save = form.cleaned_data.get('save')
-            use_default = form.cleaned_data.get('use_default')
-
-            if save:
-                if userprofile.stripe_customer_id != '' and userprofile.stripe_customer_id is not None:
-                    customer = stripe.Customer.retrieve(
-                        userprofile.stripe_customer_id)
-                    customer.sources.create(source=token)
-
-                else:
-                    customer = stripe.Customer.create(
-                        email=self.request.user.email,
-                    )
-                    customer.sources.create(source=token)
-                    userprofile.stripe_customer_id = customer['id']
-                    userprofile.one_click_purchasing = True
-                    userprofile.save()
-
-            amount = int(order.get_total() * 100)
-
-            try:
-
-                if use_default or save:
-                    # charge the customer because we cannot charge the token more than once
-                    charge = stripe.Charge.create(
-                        amount=amount,  # cents
-                        currency="usd",
-                        customer=userprofile.stripe_customer_id
-                    )
-                else:
-                    # charge once off on the token
-                    charge = stripe.Charge.create(
-                        amount=amount,  # cents
-                        currency="usd",
-                        source=token
-                    )
-
-                # create the payment
-                payment = Payment()
-                payment.stripe_charge_id = charge['id']
-                payment.user = self.request.user
-                payment.amount = order.get_total()
-                payment.save()
-
-                # assign the payment to the order
-
-                order_items = order.items.all()
-                order_items.update(ordered=True)
-                for item in order_items:
-                    item.save()
-
-                order.ordered = True
-                order.payment = payment
-                order.ref_code = create_ref_code()
-                order.save()
-
-                messages.success(self.request, "Your order was successful!")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.CardError as e:
-                body = e.json_body
-                err = body.get('error', {})
-                messages.warning(self.request, f"{err.get('message')}")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.RateLimitError as e:
-                # Too many requests made to the API too quickly
-                messages.warning(self.request, "Rate limit error")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.InvalidRequestError as e:
-                # Invalid parameters were supplied to Stripe's API
-                print(e)
-                messages.warning(self.request, "Invalid parameters")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.AuthenticationError as e:
-                # Authentication with Stripe's API failed
-                # (maybe you changed API keys recently)
-                messages.warning(self.request, "Not authenticated")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.APIConnectionError as e:
-                # Network communication with Stripe failed
-                messages.warning(self.request, "Network error")
-                return redirect("imageapp:photo-list")
-
-            except stripe.error.StripeError as e:
-                # Display a very generic error to the user, and maybe send
-                # yourself an email
-                messages.warning(
-                    self.request, "Something went wrong. You were not charged. Please try again.")
-                return redirect("imageapp:photo-list")
-
-            except Exception as e:
-                # send an email to ourselves
-                messages.warning(
-                    self.request, "A serious error occurred. We have been notifed.")
-                return redirect("imageapp:photo-list")
-
-        messages.warning(self.request, "Invalid data received")
-        return redirect("/payment/stripe/")
-
-
-
-def get_coupon(request, code):
-    try:
-        coupon = Coupon.objects.get(code=code)
-        return coupon
-    except ObjectDoesNotExist:
-        messages.info(request, "This coupon does not exist")
-        return redirect("imageapp:checkout")
+        return payments.PendingPayment(
+            key, token, save, use_default, attempt, order, userprofile, order.get_line_prices())
+
+    def create_customer(self, stripe, pending):
+        """Save the card on the customer, returning the id of a newly created customer."""
+        if not pending.save:
+            return None
+        userprofile = pending.userprofile
+        if userprofile.stripe_customer_id != '' and userprofile.stripe_customer_id is not None:
+            customer = stripe.Customer.retrieve(userprofile.stripe_customer_id)
+            customer.sources.create(source=pending.token, idempotency_key=f"{pending.key}-source")
+            return None
+        customer = stripe.Customer.create(
+            email=self.request.user.email,
+            idempotency_key=f"{pending.key}-customer"
+        )
+        customer.sources.create(source=pending.token, idempotency_key=f"{pending.key}-source")
+        return customer['id']
+
+    def save_customer(self, pending, customer_id):
+        userprofile = pending.userprofile
+        userprofile.stripe_customer_id = customer_id
+        userprofile.one_click_purchasing = True
+        userprofile.save()
+
+    def create_charge(self, stripe, pending):
+        if pending.use_default or pending.save:
+            # charge the customer because we cannot charge the token more than once
+            return stripe.Charge.create(
+                amount=pending.amount,
+                currency="usd",
+                customer=pending.userprofile.stripe_customer_id,
+                idempotency_key=pending.key
+            )
+        # charge once off on the token
+        return stripe.Charge.create(
+            amount=pending.amount,
+            currency="usd",
+            source=pending.token,
+            idempotency_key=pending.key
+        )
+
+    def complete(self, pending):
+        # create the payment and assign it to the order
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                stripe_charge_id=pending.charge['id'],
+                user=self.request.user,
+                amount=pending.total
+            )
+            pending.order.finalize(payment, pending.line_prices)
+            sales.record_order(pending.order, timezone.localdate(payment.timestamp))
+            payments.succeed_attempt(pending.attempt, pending.charge)
+
+        messages.success(self.request, "Your order was successful!")
+        return redirect("imageapp:photo-list")
+
+    def failed(self, attempt, message, charge=None):
+        payments.fail_attempt(attempt, message, charge)
+        if charge is None and self.redeemed_coupon_id:
+            coupons.release(self.redeemed_coupon_id)
+        messages.warning(self.request, message)
+        return redirect("imageapp:photo-list")
+
+    def replay(self, attempt, fingerprint):
+        if attempt.fingerprint != fingerprint:
+            messages.warning(
+                self.request, "This payment form was already submitted. Please try again.")
+            return redirect("imageapp:payment", payment_option='stripe')
+        if attempt.status == PaymentAttempt.SUCCEEDED:
+            messages.success(self.request, "Your order was successful!")
+        elif attempt.status == PaymentAttempt.FAILED:
+            messages.warning(self.request, attempt.message)
+        else:
+            messages.info(self.request, "Your payment is already being processed.")
+        return redirect("imageapp:photo-list")
+
 
 
 class AddCouponView(View):
     def post(self, *args, **kwargs):
         form = CouponForm(self.request.POST or None)
         if form.is_valid():
-            try:
-                code = form.cleaned_data.get('code')
-                order = Order.objects.get(
-                    user=self.request.user, ordered=False)
-                order.coupon = get_coupon(self.request, code)
-                order.save()
-                messages.success(self.request, "Successfully added coupon")
+            code = form.cleaned_data.get('code')
+            coupon = coupons.get_coupon(code)
+            if coupon is None:
+                messages.info(self.request, "This coupon does not exist")
+                return redirect("imageapp:checkout")
+            if not coupon.is_valid():
+                messages.info(self.request, "This coupon is no longer valid")
                 return redirect("imageapp:checkout")
-            except ObjectDoesNotExist:
+            # no need to load the order just to set its coupon
+            updated = Order.objects.filter(
+                user=self.request.user, ordered=False).update(coupon=coupon)
+            if not updated:
                 messages.info(self.request, "You do not have an active order")
                 return redirect("imageapp:checkout")
+            messages.success(self.request, "Successfully added coupon")
+            return redirect("imageapp:checkout")
+        messages.warning(self.request, "Please enter a coupon code")
+        return redirect("imageapp:checkout")
+
+
+
+class SalesDashboardView(LoginRequiredMixin, View):
+    def get(self, *args, **kwargs):
+        context = sales.dashboard(self.request.user)
+        return render(self.request, "imageapp/sales_dashboard.html", context)
 
 
 
@@ -526,14 +625,33 @@ class UserImageDetailView(DetailView):
     model = User
     context_object_name = 'user'
     template_name = "imageapp/user_image_detail.html"
+    paginate_by = 12
 
     def get_context_data(self, **kwargs):
         context = super(UserImageDetailView, self).get_context_data(**kwargs)
-        context['photos'] = Photo.objects.filter(user__username=self.kwargs['username'])
+        # newest first, keyset paginated on pk so deep pages cost the same
+        photos = self.object.photo_set.order_by('-pk')
+        try:
+            before = int(self.request.GET['before'])
+        except (KeyError, ValueError):
+            before = None
+        if before is not None:
+            photos = photos.filter(pk__lt=before)
+        photos = list(photos[:self.paginate_by + 1])
+        context['photos'] = photos[:self.paginate_by]
+        if len(photos) > self.paginate_by:
+            context['next_before'] = photos[self.paginate_by - 1].pk
+        context['is_first_page'] = before is None
+        try:
+            context['photo_count'] = self.object.userprofile.photo_count
+        except UserProfile.DoesNotExist:
+            # users created before profiles were
+            context['photo_count'] = self.object.photo_set.count()
         return context
 
     def get_object(self):
-        return get_object_or_404(self.model, username=self.kwargs['username'])
+        return get_object_or_404(
+            self.model.objects.select_related('userprofile'), username=self.kwargs['username'])
 
 
 
@@ -3,6 +3,17 @@ ASGI config for shopifyrepo project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with any ASGI server, e.g.::
+
+    uvicorn shopifyrepo.asgi:application --workers 4
+
+This turns on ASYNC_VIEWS, so payments and image renditions are served by
+the async views in imageapp/async_views.py; their blocking provider calls
+and image work run on ASGI_THREADS threads per process. Set ASYNC_VIEWS=0
+to serve the sync views instead. Note that under ASGI Django runs all sync
+views of a process on one thread, so keep at least as many workers as you
+would under WSGI.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
@@ -12,5 +23,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shopifyrepo.settings')
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+from imageapp.templating import warm
+warm()
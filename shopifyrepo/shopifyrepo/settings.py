@@ -13,13 +13,15 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 import os
 
 from dotenv import load_dotenv
-load_dotenv()
 
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# an explicit path saves load_dotenv from searching up from the caller's frame
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
@@ -59,13 +61,32 @@ SITE_ID = 1
 # stripe settings
 STRIPE_PUBLIC_KEY = str(os.getenv('STRIPE_TEST_PUBLIC_KEY'))
 STRIPE_SECRET_KEY = str(os.getenv('STRIPE_TEST_SECRET_KEY'))
+# point the client at another API server, e.g. http://127.0.0.1:12111 for `manage.py fake_stripe`
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
 
 
-# thumbnail settings
-from easy_thumbnails.conf import Settings as thumbnail_settings
+# thumbnail settings, easy_thumbnails' default processors are spelled out
+# so loading settings doesn't import easy_thumbnails
 THUMBNAIL_PROCESSORS = (
     "image_cropping.thumbnail_processors.crop_corners",
-) + thumbnail_settings.THUMBNAIL_PROCESSORS
+    "easy_thumbnails.processors.colorspace",
+    "easy_thumbnails.processors.autocrop",
+    "easy_thumbnails.processors.scale_and_crop",
+    "easy_thumbnails.processors.filters",
+    "easy_thumbnails.processors.background",
+)
+
+
+# on-demand image renditions (see imageapp/renditions.py)
+RENDITION_MAX_SIZE = (2000, 2000)
+RENDITION_QUALITY = 85
+RENDITION_CACHE_DIR = str(BASE_DIR / 'media' / 'renditions')
+RENDITION_CACHE_MAX_BYTES = int(os.getenv('RENDITION_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# cross-process single-flight locks for thumbnails and renditions (see imageapp/locks.py)
+SINGLE_FLIGHT_LOCK_DIR = str(BASE_DIR / '.locks')
+# seconds a request waits for another worker's render before using a placeholder
+SINGLE_FLIGHT_WAIT = 5
 
 
 # Authentication backend configuration django-allauth
@@ -89,23 +110,104 @@ LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = 'imageapp:photo-list'
 ACCOUNT_LOGOUT_REDIRECT_URL = 'imageapp:photo-list'
 
+# anonymous carts are kept in a signed cookie (see imageapp/cart.py)
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+CART_MAX_ITEMS = 100
+
+# per-process coupon lookup cache (see imageapp/coupons.py)
+COUPON_CACHE_SIZE = 1024
+COUPON_CACHE_TTL = 60
+
+# write-behind view/add-to-cart counters and the trending feed (see
+# imageapp/popularity.py). Counts are flushed every POPULARITY_FLUSH_INTERVAL
+# seconds per worker; an event weighs half as much after TRENDING_HALF_LIFE
+POPULARITY_FLUSH_INTERVAL = 30
+POPULARITY_WEIGHTS = {'views': 1, 'carts': 5}
+TRENDING_HALF_LIFE = 6 * 60 * 60
+TRENDING_SIZE = 8
+TRENDING_CACHE_TTL = 60
+
+# token bucket rate limits per user (or IP when anonymous), see
+# imageapp/ratelimit.py. RATELIMIT_STORE=memory counts per worker, sqlite
+# shares the buckets between the workers of a host
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', '1') == '1'
+RATELIMIT_STORE = os.getenv('RATELIMIT_STORE', 'memory')
+RATELIMIT_SQLITE_PATH = str(BASE_DIR / '.ratelimit.sqlite3')
+RATELIMITS = {
+    # url name: (rate, limited methods)
+    'imageapp:add-to-cart': ('30/m', ('GET', 'POST')),
+    'imageapp:add-photo': ('20/h', ('POST',)),
+    'imageapp:payment': ('10/m', ('POST',)),
+}
+
+# cache: a per-process LRU (L1) over a file-based cache shared by the
+# workers of a host (L2), see imageapp/cache.py. Entries stay in L1 for at
+# most L1_TTL seconds; sessions skip it so a login is seen by every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'imageapp.cache.TwoTierCache',
+        'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / '.cache')),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L1_MAX_BYTES': 32 * 1024 * 1024,
+            'L1_TTL': 5,
+            'VERSION_TTL': 1,
+            'L1_EXCLUDE': ['django.contrib.sessions'],
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+# cache key prefixes dropped in every worker when these models change
+CACHE_INVALIDATION = {
+    'imageapp.Photo': ['photo', 'trending'],
+}
+
+# sessions: SESSION_BACKEND names one of django's session backends, `db`
+# (default), `cached_db` (backed by the shared cache above) or
+# `signed_cookies` (no server side storage at all). Unchanged sessions are
+# never written back, see imageapp/sessions.py
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.getenv('SESSION_BACKEND', 'db')
+# flash messages travel in a cookie instead of the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# ASGI mode (see shopifyrepo/asgi.py): serve the payment and rendition views
+# as async views, with blocking provider calls and image work run on a pool
+# of ASGI_THREADS threads
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == '1'
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 32))
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'imageapp.sessions.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'imageapp.ratelimit.RateLimitMiddleware',
+    'imageapp.cart.CookieCartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'shopifyrepo.urls'
 
+# templates: TEMPLATE_CACHE=1 parses each template once per worker (Django's
+# cached loader, warmed when the WSGI/ASGI application loads) even with
+# DEBUG on, TEMPLATE_TIMING=1 adds render times per template and per timed
+# tag to /metrics/. See imageapp/templating.py and manage.py compile_templates
+TEMPLATE_CACHE = os.getenv('TEMPLATE_CACHE', '0' if DEBUG else '1') == '1'
+TEMPLATE_TIMING = os.getenv('TEMPLATE_TIMING') == '1'
+# part of the key of every cached template fragment, so fragments rendered
+# by the previous release are not served after a deploy; set it to the
+# release (e.g. the git sha) when deploying
+TEMPLATE_CACHE_VERSION = os.getenv('TEMPLATE_CACHE_VERSION', '1')
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': ('imageapp.templating.TimedDjangoTemplates' if TEMPLATE_TIMING
+                    else 'django.template.backends.django.DjangoTemplates'),
         'DIRS': [BASE_DIR /  'templates'],
-        'APP_DIRS': True,
+        'APP_DIRS': not TEMPLATE_CACHE,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -117,6 +219,14 @@ TEMPLATES = [
     },
 ]
 
+if TEMPLATE_CACHE:
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'shopifyrepo.wsgi.application'
 
 